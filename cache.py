@@ -0,0 +1,127 @@
+import asyncio
+import gzip
+import hashlib
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import orjson
+
+
+def normalize_text(text: str) -> str:
+    """Normalize free text so trivially different inputs share a cache key"""
+    text = unicodedata.normalize("NFC", text)
+    return " ".join(text.split()).lower()
+
+
+def make_cache_key(**parts: Any) -> str:
+    """Build a stable SHA-256 cache key from the given keyword parts"""
+    payload = orjson.dumps(parts, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+
+class AsyncTTLCache:
+    """In-process LRU cache with per-entry expiry, safe to share between coroutines"""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 86400):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        async with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            # Mark as most recently used
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        async with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            # Evict least recently used entries beyond capacity
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    async def delete(self, key: str) -> bool:
+        async with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    async def clear(self) -> int:
+        async with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            return count
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+class RedisCache:
+    """Redis-backed cache with the same async API as AsyncTTLCache, shared by all workers and replicas
+
+    Values are stored as gzipped JSON under prefix + key with a TTL. The redis
+    package is only imported when a RedisCache is created.
+    """
+
+    def __init__(self, url: str, prefix: str = "odr:v1:", ttl: float = 86400):
+        import redis.asyncio as redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        payload = await self.client.get(self.prefix + key)
+        if payload is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return orjson.loads(gzip.decompress(payload))
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        payload = gzip.compress(orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS))
+        await self.client.setex(self.prefix + key, int(self.ttl if ttl is None else ttl), payload)
+
+    async def delete(self, key: str) -> bool:
+        return await self.client.delete(self.prefix + key) > 0
+
+    async def clear(self) -> int:
+        keys = [key async for key in self.client.scan_iter(match=self.prefix + "*")]
+        return await self.client.delete(*keys) if keys else 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
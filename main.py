@@ -8,7 +8,7 @@ from langchain.tools import Tool
 from dotenv import load_dotenv
 from anyio import ClosedResourceError
 import urllib.parse
-from odr import OpenDeepResearch 
+from odr import OpenDeepResearch, MIN_TOPIC_LENGTH, MAX_TOPIC_LENGTH
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -25,9 +25,18 @@ params = {
 query_string = urllib.parse.urlencode(params)
 MCP_SERVER_URL = f"{base_url}?{query_string}"
 
+# Shared across tool calls so the compiled research graph is built once per process,
+# but only on the first research request rather than at startup
+research = None
+
+def get_research() -> OpenDeepResearch:
+    global research
+    if research is None:
+        research = OpenDeepResearch()
+    return research
+
 async def odr_tool_async(topic: str):
-    research = OpenDeepResearch()
-    report = await research.generate_research_report(topic)
+    report = await get_research().generate_research_report(topic)
     return (report, report)
 
 def get_tools_description(tools):
@@ -117,7 +126,9 @@ async def main():
                         "properties": {
                             "topic": {
                                 "type": "string",
-                                "description": "The topic for the research report"
+                                "description": "The topic for the research report",
+                                "minLength": MIN_TOPIC_LENGTH,
+                                "maxLength": MAX_TOPIC_LENGTH
                             }
                         },
                         "required": ["topic"],
@@ -143,4 +154,9 @@ async def main():
             await asyncio.sleep(5)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # uvloop comes with uvicorn[standard]; fall back to the stock loop where it is unavailable
+    try:
+        import uvloop
+    except ImportError:
+        uvloop = None
+    (uvloop.run if uvloop else asyncio.run)(main())
\ No newline at end of file
@@ -2,14 +2,40 @@ import os
 import sys
 import uuid
 import asyncio
+from typing import Dict
 from dotenv import load_dotenv
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.types import Command
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "open_deep_research")))
-from graph import builder
+from cache import AsyncTTLCache, RedisCache, make_cache_key, normalize_text
 
 load_dotenv()
 
+# Finished reports keyed by normalized topic + model settings, so repeated topics skip the LLM pipeline.
+# With REDIS_URL set the cache is shared across workers and instances instead of per process.
+if os.getenv("REDIS_URL"):
+    report_cache = RedisCache(os.getenv("REDIS_URL"), ttl=float(os.getenv("REPORT_CACHE_TTL", "86400")))
+else:
+    report_cache = AsyncTTLCache(
+        maxsize=int(os.getenv("REPORT_CACHE_SIZE", "256")),
+        ttl=float(os.getenv("REPORT_CACHE_TTL", "86400"))
+    )
+
+MIN_TOPIC_LENGTH = 3
+MAX_TOPIC_LENGTH = 2000
+
+def validate_topic(topic: str) -> str:
+    """Strip the topic and reject empty, oversized or control-character input before any LLM call"""
+    topic = topic.strip()
+    if not MIN_TOPIC_LENGTH <= len(topic) <= MAX_TOPIC_LENGTH:
+        raise ValueError(f"Topic must be between {MIN_TOPIC_LENGTH} and {MAX_TOPIC_LENGTH} characters.")
+    if any(ord(char) < 32 and char not in "\n\t" for char in topic):
+        raise ValueError("Topic must not contain control characters.")
+    return topic
+
+# In-flight report runs keyed like report_cache, so duplicate concurrent misses await one run
+inflight_reports: Dict[str, asyncio.Task] = {}
+
 class OpenDeepResearch:
     def __init__(self):
         self.REPORT_STRUCTURE = """Use this structure to create a report on the user-provided topic:
@@ -23,47 +49,91 @@ class OpenDeepResearch:
         3. Conclusion
         - Aim for 1 structural element (either a list or table) that distills the main body sections 
         - Provide a concise summary of the report"""
+        self.model_config = {
+            "search_api": "duckduckgo",
+            "planner_provider": "groq",
+            "planner_model": "llama3-70b-8192",
+            "writer_provider": "groq",
+            "writer_model": "llama3-70b-8192",
+            "max_search_depth": 0,
+            "number_of_queries": 1,
+        }
+        # The graph module pulls in every search and LLM integration, so import it only when an instance is built
+        from graph import builder
+
+        # Compile the graph once per instance; each report runs in its own checkpoint thread
+        self.memory = MemorySaver()
+        self.graph = builder.compile(checkpointer=self.memory)
 
     async def generate_research_report(self, topic: str):
-        # Setup memory + graph
-        memory = MemorySaver()
-        graph = builder.compile(checkpointer=memory)
+        topic = validate_topic(topic)
+        # Concurrent requests for the same topic share one pipeline run instead of each starting their own
+        key = make_cache_key(topic=normalize_text(topic), **self.model_config)
+        task = inflight_reports.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._collect_research_report(topic))
+            inflight_reports[key] = task
+            task.add_done_callback(lambda _: inflight_reports.pop(key, None))
+        # Shield so one caller giving up does not cancel the run for the others
+        return await asyncio.shield(task)
+
+    async def _collect_research_report(self, topic: str):
+        async for event, content in self.astream_research_report(topic):
+            if event == "report":
+                return content
+
+    async def astream_research_report(self, topic: str):
+        """Yield ("section", markdown) as each section finishes, then ("report", full_report)"""
+        topic = validate_topic(topic)
+        cache_key = make_cache_key(topic=normalize_text(topic), **self.model_config)
+        cached_report = await report_cache.get(cache_key)
+        if cached_report is not None:
+            yield "report", cached_report
+            return
+
+        async for event, content in self._stream_research_graph(topic):
+            if event == "report":
+                await report_cache.set(cache_key, content)
+            yield event, content
+
+    async def _stream_research_graph(self, topic: str):
+        graph = self.graph
 
         # Thread config like in notebook
+        thread_id = str(uuid.uuid4())
         thread = {
             "configurable": {
-                "thread_id": str(uuid.uuid4()),
-                "search_api": "duckduckgo",
-                "planner_provider": "groq",
-                "planner_model": "llama3-70b-8192",
-                "writer_provider": "groq",
-                "writer_model": "llama3-70b-8192",
-                "max_search_depth": 0,
-                "number_of_queries": 1,
+                "thread_id": thread_id,
+                **self.model_config,
                 "report_structure": self.REPORT_STRUCTURE,
-            }
+            },
+            # Upper bound on section tasks (and their LLM calls) running in parallel
+            "max_concurrency": int(os.getenv("RESEARCH_MAX_CONCURRENCY", "30")),
         }
 
-        # Step 1: Run graph with the topic
-        async for _ in graph.astream({"topic": topic}, thread, stream_mode="updates"):
-            pass
+        try:
+            # Step 1: Run graph with the topic
+            async for _ in graph.astream({"topic": topic}, thread, stream_mode="updates"):
+                pass
 
-        # Step 2: Resume automatically (like skipping feedback)
-        async for _ in graph.astream(Command(resume=True), thread, stream_mode="updates"):
-            print(_)
-            print("\n")
-            pass
+            # Step 2: Resume automatically (like skipping feedback), passing on sections as they complete
+            async for update in graph.astream(Command(resume=True), thread, stream_mode="updates"):
+                for node_update in update.values():
+                    for section in (node_update or {}).get("completed_sections", []):
+                        yield "section", section.content
 
-        # Step 3: Get final report
-        final_state = graph.get_state(thread)
-        report = final_state.values.get("final_report")
+            # Step 3: Get final report
+            final_state = graph.get_state(thread)
+            report = final_state.values.get("final_report")
+        finally:
+            # The shared checkpointer would otherwise keep every finished thread in memory
+            self.memory.delete_thread(thread_id)
         
         # Check if report was generated successfully
         if not report:
             raise ValueError("No report was generated. Please check the topic and try again.")
 
-        return report
-
+        yield "report", report
 
 if __name__ == "__main__":
     topic = "What is Model Context Protocol?"
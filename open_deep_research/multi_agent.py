@@ -1,3 +1,4 @@
+import asyncio
 from typing import List, Annotated, TypedDict, operator, Literal
 from pydantic import BaseModel, Field
 
@@ -252,15 +253,20 @@ async def research_agent_tools(state: SectionState, config: RunnableConfig):
     # Get tools based on configuration
     _, research_tools_by_name = get_research_tools(config)
     
-    # Process all tool calls first (required for OpenAI)
-    for tool_call in state["messages"][-1].tool_calls:
+    async def run_tool_call(tool_call):
         # Get the tool
         tool = research_tools_by_name[tool_call["name"]]
         # Perform the tool call - use ainvoke for async tools
         if hasattr(tool, 'ainvoke'):
-            observation = await tool.ainvoke(tool_call["args"])
-        else:
-            observation = tool.invoke(tool_call["args"])
+            return await tool.ainvoke(tool_call["args"])
+        return tool.invoke(tool_call["args"])
+
+    # Process all tool calls first (required for OpenAI); the calls are independent,
+    # so parallel searches run concurrently and results come back in call order
+    tool_calls = state["messages"][-1].tool_calls
+    observations = await asyncio.gather(*(run_tool_call(tool_call) for tool_call in tool_calls))
+
+    for tool_call, observation in zip(tool_calls, observations):
         # Append to messages 
         result.append({"role": "tool", 
                        "content": observation, 
@@ -23,10 +23,55 @@ from markdownify import markdownify
 from langchain_community.retrievers import ArxivRetriever
 from langchain_community.utilities.pubmed import PubMedAPIWrapper
 from langchain_core.tools import tool
+from langchain_core.messages import SystemMessage
+from langchain.chat_models import init_chat_model
 
 from langsmith import traceable
 
 from open_deep_research.state import Section
+
+# Providers whose LangChain chat models accept an injected httpx.AsyncClient
+POOLED_MODEL_PROVIDERS = {"groq", "openai"}
+
+_shared_llm_http_client: Optional[httpx.AsyncClient] = None
+
+def get_llm_http_client() -> httpx.AsyncClient:
+    """
+    Return the process-wide httpx.AsyncClient used for LLM API calls.
+
+    The default pool inside each provider SDK caps concurrency well below the
+    provider rate limits, so parallel section writers would queue on it.
+    """
+    global _shared_llm_http_client
+    if _shared_llm_http_client is None or _shared_llm_http_client.is_closed:
+        _shared_llm_http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "2000")),
+                max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "1500"))
+            ),
+            timeout=httpx.Timeout(120.0)
+        )
+    return _shared_llm_http_client
+
+def init_pooled_chat_model(model: str, model_provider: str, **kwargs):
+    """
+    Wrapper around init_chat_model that routes supported providers through the shared connection pool
+    """
+    if model_provider in POOLED_MODEL_PROVIDERS:
+        kwargs.setdefault("http_async_client", get_llm_http_client())
+    return init_chat_model(model=model, model_provider=model_provider, **kwargs)
+
+def cacheable_system_message(content: str, model_provider: str) -> SystemMessage:
+    """
+    Build a system message for instructions that are identical across calls.
+
+    Anthropic only reuses a prompt prefix when the block is explicitly marked with
+    cache_control; Groq and OpenAI cache identical prefixes automatically, so for
+    them the message is left as plain text and only needs to come first.
+    """
+    if model_provider == "anthropic":
+        return SystemMessage(content=[{"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}])
+    return SystemMessage(content=content)
     
 def get_config_value(value):
     """
@@ -1191,32 +1236,35 @@ async def scrape_pages(titles: List[str], urls: List[str]) -> str:
     
     # Create an async HTTP client
     async with httpx.AsyncClient(follow_redirects=True, timeout=30.0) as client:
-        pages = []
-        
-        # Fetch each URL and convert to markdown
-        for url in urls:
-            try:
-                # Fetch the content
-                response = await client.get(url)
-                response.raise_for_status()
-                
-                # Convert HTML to markdown if successful
-                if response.status_code == 200:
-                    # Handle different content types
-                    content_type = response.headers.get('Content-Type', '')
-                    if 'text/html' in content_type:
-                        # Convert HTML to markdown
-                        markdown_content = markdownify(response.text)
-                        pages.append(markdown_content)
+        # Limit simultaneous fetches so long result lists don't open too many sockets at once
+        semaphore = asyncio.Semaphore(10)
+
+        async def fetch_page(url):
+            async with semaphore:
+                try:
+                    # Fetch the content
+                    response = await client.get(url)
+                    response.raise_for_status()
+                    
+                    # Convert HTML to markdown if successful
+                    if response.status_code == 200:
+                        # Handle different content types
+                        content_type = response.headers.get('Content-Type', '')
+                        if 'text/html' in content_type:
+                            # Convert HTML to markdown
+                            return markdownify(response.text)
+                        else:
+                            # For non-HTML content, just mention the content type
+                            return f"Content type: {content_type} (not converted to markdown)"
                     else:
-                        # For non-HTML content, just mention the content type
-                        pages.append(f"Content type: {content_type} (not converted to markdown)")
-                else:
-                    pages.append(f"Error: Received status code {response.status_code}")
+                        return f"Error: Received status code {response.status_code}"
+            
+                except Exception as e:
+                    # Handle any exceptions during fetch
+                    return f"Error fetching URL: {str(e)}"
         
-            except Exception as e:
-                # Handle any exceptions during fetch
-                pages.append(f"Error fetching URL: {str(e)}")
+        # Fetch all URLs concurrently; gather keeps results in input order
+        pages = await asyncio.gather(*(fetch_page(url) for url in urls))
         
         # Create formatted output
         formatted_output = f"Search results: \n\n"
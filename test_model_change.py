@@ -5,8 +5,8 @@ Test script to verify the model change to mixtral-8x7b-32768 works correctly.
 
 import os
 import asyncio
+import functools
 import json
-import re
 from dotenv import load_dotenv
 from langchain.chat_models import init_chat_model
 from langchain.schema import SystemMessage, HumanMessage
@@ -14,6 +14,24 @@ from langchain.schema import SystemMessage, HumanMessage
 # Load environment variables from .env file
 load_dotenv()
 
+# The prompt never changes between runs, so build the messages once at import
+JSON_TEST_MESSAGES = [
+    SystemMessage(content="You are a JSON generator. You must return ONLY a valid JSON object. Do not return just a string or single value. Return the complete JSON object."),
+    HumanMessage(content="""Generate this exact JSON object (copy it exactly):\n{\n    \"test\": \"value\",\n    \"number\": 42,\n    \"array\": [\"item1\", \"item2\"]\n}""")
+]
+
+@functools.lru_cache(maxsize=8)
+def get_model(name: str, provider: str):
+    """Return a shared JSON-mode chat model for the given model name and provider"""
+    return init_chat_model(
+        model=name,
+        model_provider=provider,
+        api_key=os.environ["GROQ_API_KEY"],
+        temperature=0.1,
+        max_tokens=4000,
+        model_kwargs={"response_format": {"type": "json_object"}}
+    )
+
 async def test_model():
     """Test the new model with a simple JSON generation task"""
     
@@ -26,23 +44,12 @@ async def test_model():
     try:
         # Initialize the new model
         print("🔄 Initializing llama3-70b-8192 model...")
-        model = init_chat_model(
-            model="llama3-70b-8192",  # Reliable for JSON generation
-            model_provider="groq",
-            api_key=groq_api_key,
-            temperature=0.1,
-            max_tokens=4000
-        )
+        model = get_model("llama3-70b-8192", "groq")  # Reliable for JSON generation
         print("✅ Model initialized successfully")
         
         # Test with a more explicit JSON generation task
         print("🔄 Testing JSON generation...")
-        messages = [
-            SystemMessage(content="You are a JSON generator. You must return ONLY a valid JSON object. Do not return just a string or single value. Return the complete JSON object."),
-            HumanMessage(content="""Generate this exact JSON object (copy it exactly):\n{\n    \"test\": \"value\",\n    \"number\": 42,\n    \"array\": [\"item1\", \"item2\"]\n}""")
-        ]
-        
-        response = await model.ainvoke(messages)
+        response = await model.ainvoke(JSON_TEST_MESSAGES)
         content = response.content.strip()
         
         print(f"📝 Raw response: {repr(content)}")  # Shows exact characters including newlines
@@ -50,16 +57,7 @@ async def test_model():
         print(f"🔍 First 100 chars: {content[:100]}")
         print(f"🔍 Last 100 chars: {content[-100:]}")
         
-        # Clean the response
-        if content.startswith('```json'):
-            content = content[7:]
-        if content.endswith('```'):
-            content = content[:-3]
-        content = content.strip()
-        
-        print(f"🧹 Cleaned response: {repr(content)}")
-        
-        # Try to parse JSON
+        # JSON mode guarantees a valid object, so no cleanup or extraction is needed
         try:
             parsed_json = json.loads(content)
             print("✅ JSON parsing successful!")
@@ -68,33 +66,6 @@ async def test_model():
         except json.JSONDecodeError as e:
             print(f"❌ JSON parsing failed: {e}")
             print(f"🔍 Content that failed: {content}")
-            
-            # Try to extract JSON using regex
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
-            if json_match:
-                try:
-                    extracted_json = json.loads(json_match.group())
-                    print("✅ JSON extraction successful!")
-                    print(f"📊 Extracted JSON: {extracted_json}")
-                    return True
-                except json.JSONDecodeError as e2:
-                    print(f"❌ JSON extraction also failed: {e2}")
-            
-            # If AI returned just a string, construct a simple JSON
-            if content.startswith('"') and content.endswith('"'):
-                try:
-                    test_value = content[1:-1]  # Remove quotes
-                    constructed_json = {
-                        "test": test_value,
-                        "number": 42,
-                        "array": ["item1", "item2"]
-                    }
-                    print("✅ Constructed JSON from string value")
-                    print(f"📊 Constructed JSON: {constructed_json}")
-                    return True
-                except Exception as e3:
-                    print(f"❌ JSON construction failed: {e3}")
-            
             return False
             
     except Exception as e:
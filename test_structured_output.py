@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Feeds realistic Groq tool-call responses through CoralResearchAgent._cached_invoke to check
+that the rule and campaign prompts and schemas agree with what the model sends back.
+"""
+
+import asyncio
+import json
+
+import httpx
+from langchain_groq import ChatGroq
+
+import web_service
+from web_service import CampaignSuggestionList, CoralResearchAgent, RuleSuggestionList
+
+RULE_ARGUMENTS = {
+    "rules": [
+        {
+            "name": "Widget Upsell",
+            "description": "Upsell for Widget",
+            "trigger_type": "cart_value",
+            "trigger_conditions": {"cart_value_operator": "greater_than", "cart_value": 60.0},
+            "target_products": ["p1"],
+            "display_type": "popup",
+            "display_settings": {},
+            "priority": 4,
+            "status": "draft"
+        }
+    ]
+}
+
+CAMPAIGN_ARGUMENTS = {
+    "campaigns": [
+        {
+            "name": "Cart Exit Offer",
+            "description": "Catch shoppers leaving the cart",
+            "campaign_type": "popup",
+            "trigger_type": "exit_intent",
+            "trigger_delay": 0,
+            "trigger_scroll_percentage": 50,
+            "target_pages": ["/cart", "/checkout"],
+            "excluded_pages": [],
+            "settings": {"position": "center", "style": "modern"},
+            "content": {"title": "Wait!", "message": "Take 10% off today", "cta_text": "Claim offer", "offer": "10% off"},
+            "expected_impact": "high",
+            "implementation_notes": "Show once per session"
+        }
+    ]
+}
+
+
+def tool_call_completion(name: str, arguments: dict) -> dict:
+    """A chat completion shaped like Groq's reply to a forced tool call"""
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 1760000000,
+        "model": "llama-3.1-8b-instant",
+        "choices": [{
+            "index": 0,
+            "message": {
+                "role": "assistant",
+                "tool_calls": [{
+                    "id": "call_test",
+                    "type": "function",
+                    "function": {"name": name, "arguments": json.dumps(arguments)}
+                }]
+            },
+            "logprobs": None,
+            "finish_reason": "tool_calls"
+        }],
+        "usage": {"prompt_tokens": 480, "completion_tokens": 160, "total_tokens": 640},
+        "system_fingerprint": "fp_test",
+        "x_groq": {"id": "req_test"}
+    }
+
+
+def invoke_with_tool_call(prompt_name: str, schema, arguments: dict, **variables: str):
+    """Run _cached_invoke against a Groq model whose HTTP replies are canned tool calls"""
+    requests = []
+
+    def reply(request: httpx.Request) -> httpx.Response:
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, json=tool_call_completion(schema.__name__, arguments))
+
+    async def run():
+        llm = ChatGroq(
+            model="llama-3.1-8b-instant",
+            api_key="test",
+            temperature=0,
+            http_async_client=httpx.AsyncClient(transport=httpx.MockTransport(reply))
+        )
+        agent = object.__new__(CoralResearchAgent)
+        agent.model = llm
+        messages, prompt_key = agent._prepare_prompt(prompt_name, **variables)
+        await web_service.llm_response_cache.delete(agent._llm_cache_key(prompt_key, llm, schema))
+        return await agent._cached_invoke(messages, prompt_key, llm, schema=schema)
+
+    return asyncio.run(run()), requests
+
+
+def test_rules_tool_call():
+    output, requests = invoke_with_tool_call(
+        "rules", RuleSuggestionList, RULE_ARGUMENTS,
+        data_analysis_json='{"total_orders":12}',
+        products_json='[{"id":"p1","title":"Widget","price":20}]'
+    )
+    assert output == RULE_ARGUMENTS
+
+    body = requests[0]
+    assert body["tool_choice"]["function"]["name"] == "RuleSuggestionList"
+    system_prompt = body["messages"][0]["content"]
+    assert "RuleSuggestionList" in system_prompt
+    assert "JSON array" not in system_prompt and "ONLY valid JSON" not in system_prompt
+
+
+def test_campaigns_tool_call():
+    output, requests = invoke_with_tool_call(
+        "campaigns", CampaignSuggestionList, CAMPAIGN_ARGUMENTS,
+        data_analysis_json='{"total_orders":12}'
+    )
+    assert output == CAMPAIGN_ARGUMENTS
+
+    body = requests[0]
+    assert body["tool_choice"]["function"]["name"] == "CampaignSuggestionList"
+    system_prompt = body["messages"][0]["content"]
+    assert "CampaignSuggestionList" in system_prompt
+    assert "JSON array" not in system_prompt and "ONLY valid JSON" not in system_prompt
+
+
+if __name__ == "__main__":
+    test_rules_tool_call()
+    test_campaigns_tool_call()
+    print("✅ Rule and campaign tool calls parse into their schemas")
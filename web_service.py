@@ -1,23 +1,36 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
 import asyncio
+import copy
+import hashlib
+import heapq
+import httpx
 import os
 import json
-from typing import List, Dict, Any, Optional
+import time
+import orjson
+from typing import List, Dict, Any, Literal, Optional
+from collections import Counter
+from itertools import islice
 from dotenv import load_dotenv
 import logging
-from supabase import create_client, Client
+from supabase import AsyncClient, acreate_client
+from supabase.lib.client_options import AsyncClientOptions
 from langchain.chat_models import init_chat_model
 from langchain.prompts import ChatPromptTemplate
-import pandas as pd
-from datetime import datetime, timedelta
-import traceback
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from uuid import UUID
+import groq
+from cache import AsyncTTLCache, RedisCache
 
 load_dotenv()
 
 # Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 app = FastAPI(
@@ -26,52 +39,643 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Add CORS middleware
+# Add CORS middleware; set CORS_ALLOWED_ORIGINS to a comma-separated list in production
+cors_origins = [origin.strip() for origin in os.getenv("CORS_ALLOWED_ORIGINS", "*").split(",") if origin.strip()]
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=cors_origins,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "authorization"],
+    max_age=86400,  # Let browsers cache preflight responses for a day
 )
 
-# Initialize Supabase client with error handling
+# Analysis payloads are text-heavy JSON; compress anything over 500 bytes. Compression is
+# added after CORS so it wraps the CORS headers rather than the other way round.
+# Brotli is preferred when available; it falls back to gzip for clients without br support.
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(BrotliMiddleware, quality=4, minimum_size=500, gzip_fallback=True)
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=500, compresslevel=5)
+
+# Supabase credentials; the async client itself is created at startup, inside the event loop
 supabase_url = os.getenv("NEXT_PUBLIC_SUPABASE_URL") or os.getenv("SUPABASE_URL")
 supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+supabase: Optional[AsyncClient] = None
 
 if not supabase_url or not supabase_key:
     logger.warning("Supabase credentials not found. Running in demo mode.")
-    logger.warning(f"SUPABASE_URL: {'Set' if supabase_url else 'Missing'}")
-    logger.warning(f"SUPABASE_SERVICE_ROLE_KEY: {'Set' if supabase_key else 'Missing'}")
-    supabase = None
-else:
-    try:
-        supabase: Client = create_client(supabase_url, supabase_key)
-        logger.info("Supabase client initialized successfully")
-    except Exception as e:
-        logger.error(f"Failed to initialize Supabase client: {str(e)}")
-        supabase = None
+    logger.warning("SUPABASE_URL: %s", 'Set' if supabase_url else 'Missing')
+    logger.warning("SUPABASE_SERVICE_ROLE_KEY: %s", 'Set' if supabase_key else 'Missing')
 
 # Initialize Groq model with error handling
 groq_api_key = os.getenv("GROQ_API_KEY")
 if not groq_api_key:
     logger.error("GROQ_API_KEY not found. Please set the environment variable.")
     model = None
+    fast_model = None
 else:
     try:
+        # Output is capped and sampled greedily so a rambling or malformed completion fails fast
+        # into the retry/fallback path; each call gives up after LLM_TIMEOUT_SECONDS.
+        llm_timeout = float(os.getenv("LLM_TIMEOUT_SECONDS", "20"))
+        # Insights are a single JSON object, so the larger model runs in Groq's JSON mode
         model = init_chat_model(
-            model="llama3-70b-8192",  # Reliable for JSON generation
+            model=os.getenv("ANALYSIS_MODEL", "llama3-70b-8192"),  # Reliable for JSON generation
+            model_provider="groq",
+            api_key=groq_api_key,
+            temperature=0,
+            max_tokens=int(os.getenv("ANALYSIS_MAX_TOKENS", "1500")),
+            timeout=llm_timeout,
+            max_retries=1,
+            model_kwargs={"response_format": {"type": "json_object"}}
+        )
+        # Rule and campaign lists come from a smaller, faster model with a tighter output budget
+        fast_model = init_chat_model(
+            model=os.getenv("ANALYSIS_FAST_MODEL", "llama-3.1-8b-instant"),
             model_provider="groq",
             api_key=groq_api_key,
-            temperature=0.1,
-            max_tokens=4000
+            temperature=0,
+            max_tokens=int(os.getenv("ANALYSIS_FAST_MAX_TOKENS", "1200")),
+            timeout=llm_timeout,
+            max_retries=1
         )
-        logger.info("Groq model initialized successfully")
+        logger.info("Groq models initialized successfully")
     except Exception as e:
-        logger.error(f"Failed to initialize Groq model: {str(e)}")
+        logger.error("Failed to initialize Groq model: %s", e)
         model = None
+        fast_model = None
+
+# Recent LLM responses keyed by model + prompt, so re-analyzing unchanged data skips the Groq call.
+# A second, per-user cache keyed on the shape of the prompt inputs (see shape_of) also serves
+# rule suggestions for data that has only drifted slightly, like one more order since the last
+# run. Insights and campaigns quote the data's numbers back, so they only use the exact cache.
+# Complete analyses are keyed by user, time range and any sent data. They are served as-is
+# for ANALYSIS_CACHE_FRESH_SECONDS, then served stale while a background run refreshes them,
+# until ANALYSIS_CACHE_TTL expires them outright. Each worker process has its own
+# in-memory caches; with REDIS_URL set, all workers and instances share them instead.
+redis_url = os.getenv("REDIS_URL")
+if redis_url:
+    llm_response_cache = RedisCache(redis_url, prefix="llm:v1:", ttl=float(os.getenv("LLM_CACHE_TTL", "900")))
+    llm_shape_cache = RedisCache(redis_url, prefix="llm-shape:v1:", ttl=float(os.getenv("LLM_SHAPE_CACHE_TTL", "3600")))
+    analysis_cache = RedisCache(redis_url, prefix="analysis:v2:", ttl=float(os.getenv("ANALYSIS_CACHE_TTL", "600")))
+else:
+    llm_response_cache = AsyncTTLCache(
+        maxsize=int(os.getenv("LLM_CACHE_SIZE", "1024")),
+        ttl=float(os.getenv("LLM_CACHE_TTL", "900"))
+    )
+    llm_shape_cache = AsyncTTLCache(
+        maxsize=int(os.getenv("LLM_CACHE_SIZE", "1024")),
+        ttl=float(os.getenv("LLM_SHAPE_CACHE_TTL", "3600"))
+    )
+    analysis_cache = AsyncTTLCache(
+        maxsize=int(os.getenv("ANALYSIS_CACHE_SIZE", "1024")),
+        ttl=float(os.getenv("ANALYSIS_CACHE_TTL", "600"))
+    )
+ANALYSIS_FRESH_SECONDS = float(os.getenv("ANALYSIS_CACHE_FRESH_SECONDS", "60"))
+# Analyses currently running, so concurrent identical requests share one run
+inflight_analyses: Dict[str, asyncio.Task] = {}
+# Fetched table data per (user, time range), kept briefly in this process so polling, retries
+# and /analyze/stream reuse one set of queries; concurrent fetches for the same key are shared
+user_data_cache = AsyncTTLCache(
+    maxsize=int(os.getenv("USER_DATA_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("USER_DATA_CACHE_TTL", "30"))
+)
+inflight_fetches: Dict[str, asyncio.Task] = {}
+
+def to_prompt_json(obj: Any) -> str:
+    """Serialize data for a prompt as compact JSON; pretty-printing only adds tokens"""
+    return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+
+def size_bucket(count: int) -> str:
+    """Coarse size class for counts when matching structurally similar prompt inputs"""
+    if count <= 0:
+        return "0"
+    if count <= 5:
+        return "1-5"
+    if count <= 20:
+        return "6-20"
+    if count <= 100:
+        return "21-100"
+    return "100+"
+
+def shape_of(value: Any) -> Any:
+    """value with counts bucketed and other numbers rounded to two significant figures
+    
+    Only for prompts whose answers don't repeat the input numbers: a bucket such as 21-100
+    orders spans counts far enough apart that quoted figures would be wrong. Strings such
+    as product IDs are kept exact.
+    """
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, int):
+        return size_bucket(value)
+    if isinstance(value, float):
+        return float(f"{value:.2g}")
+    if isinstance(value, dict):
+        return {key: shape_of(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [shape_of(item) for item in value]
+    return str(value)
+
+def first_by_id(rows: List[Dict[str, Any]], n: int) -> List[Dict[str, Any]]:
+    """The n rows with the lowest ids, so prompt samples don't depend on database row order"""
+    return heapq.nsmallest(n, rows, key=lambda row: str(row.get("id", "")))
+
+def log_refresh_failure(task: asyncio.Task) -> None:
+    """Done callback for background analysis refreshes, whose errors no caller awaits"""
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Background analysis refresh failed: %s", task.exception())
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Groq while the circuit breaker is open"""
+
+# Failures a retry is likely to fix: network errors and timeouts reaching Supabase, Postgres
+# or Groq, Groq rate limiting or server errors, and calls refused by an open breaker. /analyze answers them with 503 and
+# Retry-After rather than running on partial data or reporting an internal error.
+TRANSIENT_ERRORS = (
+    httpx.TransportError,
+    asyncio.TimeoutError,
+    ConnectionError,
+    groq.APIConnectionError,
+    groq.RateLimitError,
+    groq.InternalServerError,
+    CircuitOpenError,
+)
+ANALYSIS_UNAVAILABLE = "analysis_unavailable"
+ANALYSIS_FAILED = "analysis_failed"
+RETRY_AFTER_HEADERS = {"Retry-After": "10"}
+
+def is_transient(exc: Optional[BaseException]) -> bool:
+    """True if exc, or any exception it was raised from or while handling, is transient"""
+    while exc is not None:
+        if isinstance(exc, TRANSIENT_ERRORS):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+class CircuitBreaker:
+    """Async context manager that stops calling a failing dependency for a while
+    
+    After fail_max transient failures in a row the breaker opens, and entering it raises
+    CircuitOpenError straight away for reset_seconds. After that calls are let through
+    again (half open); one success closes the breaker, another failure reopens it.
+    Non-transient errors, such as a completion that fails validation, are not counted.
+    """
+    
+    __slots__ = ("fail_max", "reset_seconds", "failures", "opened_at")
+    
+    def __init__(self, fail_max: int = 5, reset_seconds: float = 30):
+        self.fail_max = fail_max
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+    
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.reset_seconds else "half_open"
+    
+    async def __aenter__(self):
+        if self.state == "open":
+            raise CircuitOpenError(f"Circuit open after {self.failures} consecutive failures")
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        if exc is None:
+            self.failures = 0
+            self.opened_at = None
+        elif is_transient(exc):
+            self.failures += 1
+            if self.failures >= self.fail_max:
+                if self.opened_at is None or self.state == "half_open":
+                    logger.warning("Groq circuit opened after %s consecutive failures", self.failures)
+                self.opened_at = time.monotonic()
+        return False
+
+# Shared by every Groq call in this process, so an outage stops costing each request a timeout
+groq_breaker = CircuitBreaker(
+    fail_max=int(os.getenv("GROQ_BREAKER_FAILURES", "5")),
+    reset_seconds=float(os.getenv("GROQ_BREAKER_RESET_SECONDS", "30"))
+)
+
+class OrjsonResponse(JSONResponse):
+    """JSONResponse encoded with orjson, for endpoints that return plain dicts
+    
+    Returning one directly skips FastAPI's response_model validation, so it is for
+    results the service built itself.
+    """
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+# Prompt templates are parsed once at import; each call only fills in the serialized data.
+# Instructions and the output format live in the system message, which is byte-identical
+# on every call, and the per-user data comes last so providers with prefix caching can
+# reuse the shared prefix
+INSIGHTS_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are a JSON generator. Return ONLY valid JSON. No text, no explanations, no markdown.
+
+Generate insights JSON for the e-commerce data in the user message.
+
+Return this exact JSON structure:
+{{
+    "customer_behavior_insights": [
+        {{"insight": "description", "impact": "high|medium|low", "action": "specific action"}}
+    ],
+    "performance_insights": [
+        {{"insight": "description", "impact": "high|medium|low", "action": "specific action"}}
+    ],
+    "product_insights": [
+        {{"insight": "description", "impact": "high|medium|low", "action": "specific action"}}
+    ],
+    "revenue_opportunities": [
+        {{"opportunity": "description", "potential_impact": "estimated revenue increase", "implementation": "how to implement"}}
+    ]
+}}"""),
+    ("user", "E-commerce data: {data_summary_json}")
+])
+
+# Rules and campaigns are returned through a forced tool call (see RuleSuggestionList and
+# CampaignSuggestionList), so these prompts describe the tool's fields instead of a JSON reply
+RULES_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You suggest upsell rules for an e-commerce store. Call the RuleSuggestionList tool with a "rules" list built from the business data and products in the user message.
+
+Each rule has:
+- name: concise and product-focused, using only product names from the available products list
+- description: one sentence, e.g. "Upsell for [actual product name]"
+- trigger_type: "cart_value", "category" or "time_based"
+- trigger_conditions: for cart_value rules, {{"cart_value_operator": "greater_than", "cart_value": 100.00}}
+- target_products: IDs from the available products list; include the ID of any product named in the rule
+- display_type: "popup"
+- display_settings: {{}}
+- priority: integer, e.g. 4
+- status: "draft"
+
+Do NOT invent product names or IDs that are not in the available products list."""),
+    ("user", """Business data: {data_analysis_json}
+
+Available products for targeting:
+{products_json}""")
+])
+
+CAMPAIGNS_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You suggest on-site marketing campaigns for an e-commerce store. Call the CampaignSuggestionList tool with a "campaigns" list built from the business data in the user message.
+
+Each campaign has:
+- name and description
+- campaign_type: e.g. "popup"
+- trigger_type: e.g. "exit_intent"
+- trigger_delay: seconds before showing, e.g. 0
+- trigger_scroll_percentage: e.g. 50
+- target_pages and excluded_pages: lists of paths, e.g. ["/cart", "/checkout"] and []
+- settings: e.g. {{"position": "center", "style": "modern"}}
+- content: {{"title": ..., "message": ..., "cta_text": ..., "offer": ...}}
+- expected_impact: "high", "medium" or "low"
+- implementation_notes: short notes for the merchant"""),
+    ("user", "Business data: {data_analysis_json}")
+])
+
+SIMPLE_INSIGHTS_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are a JSON generator. Return ONLY valid JSON.
+
+Generate insights for the e-commerce data in the user message.
+
+Return this exact JSON:
+{{
+    "customer_behavior_insights": [
+        {{"insight": "Limited data available", "impact": "medium", "action": "Add more products and orders"}}
+    ],
+    "performance_insights": [
+        {{"insight": "No performance data", "impact": "low", "action": "Track sales and conversions"}}
+    ],
+    "product_insights": [
+        {{"insight": "Basic product setup", "impact": "medium", "action": "Add product descriptions and images"}}
+    ],
+    "revenue_opportunities": [
+        {{"opportunity": "Implement upsell rules", "potential_impact": "Increase AOV by 15%", "implementation": "Create cart value rules"}}
+    ]
+}}"""),
+    ("user", "E-commerce data: {data_summary_json}")
+])
+
+PROMPTS = {
+    "insights": INSIGHTS_PROMPT,
+    "rules": RULES_PROMPT,
+    "campaigns": CAMPAIGNS_PROMPT,
+    "simple_insights": SIMPLE_INSIGHTS_PROMPT,
+}
+
+# Columns the analysis actually reads from each table; tables not listed (or whose
+# schema varies between deployments, like upsell_rules) are fetched with *
+FETCH_COLUMNS = {
+    "shopify_orders": "id,total_price,created_at",
+    "cart_events": "id,cart_total,created_at",
+    "campaigns": "id,name,status,campaign_type",
+    "products": "id,title,price,product_type",
+    "profiles": "id,plan_type,company_name",
+}
+
+# Data summary sections left out of the insights prompt; the store's name and billing plan
+# say nothing about its shoppers, and the full summary is still returned to the client
+LLM_SUMMARY_EXCLUDED = frozenset({"user_profile"})
+
+# Catalog size above which price statistics are computed with NumPy
+NUMPY_PRICE_THRESHOLD = 10000
+
+# Fetched rows (all tables together) above which data preparation leaves the event loop
+OFFLOAD_ROWS_THRESHOLD = 5000
+
+def record_to_dict(record) -> Dict[str, Any]:
+    """Convert an asyncpg record to the JSON-friendly shape the Supabase REST API returns"""
+    row = {}
+    for key, value in record.items():
+        if isinstance(value, Decimal):
+            value = float(value)
+        elif isinstance(value, (datetime, date)):
+            value = value.isoformat()
+        elif isinstance(value, UUID):
+            value = str(value)
+        row[key] = value
+    return row
+
+# Event lists the analysis only counts, samples and averages; they are reduced to
+# <name>_count, <name>_sample and <name>_stats (over the given value field) up front
+COMPACTED_LISTS = {
+    "shopify_orders": "total_price",
+    "cart_events": "cart_total",
+    "upsell_events": None,
+}
+SAMPLE_SIZE = 3
+
+def value_stats(rows: List[Dict[str, Any]], field: str) -> Dict[str, Any]:
+    """Count, total, min and max of the truthy values of field across rows, in one pass"""
+    count, total, low, high = 0, 0, None, None
+    for row in rows:
+        value = row.get(field)
+        if not value:
+            continue
+        count += 1
+        total += value
+        low = value if low is None or value < low else low
+        high = value if high is None or value > high else high
+    return {"count": count, "total": total, "min": low or 0, "max": high or 0}
+
+# Static fallback payloads, built once; callers get a fresh list but share the entries
+FALLBACK_RULES = (
+    {
+        "name": "Cart Value Upsell",
+        "description": "Show upsell when cart value is above threshold",
+        "trigger_type": "cart_value",
+        "trigger_conditions": {
+            "cart_value_operator": "greater_than",
+            "cart_value": 50
+        },
+        "actions": {
+            "action_type": "show_campaign",
+            "campaign_id": "cart_value_upsell"
+        },
+        "priority": 5,
+        "expected_impact": "medium",
+        "implementation_notes": "Create a campaign for cart value upsells"
+    },
+)
+
+FALLBACK_CAMPAIGNS = (
+    {
+        "name": "Exit Intent Upsell",
+        "description": "Show upsell when user tries to leave",
+        "campaign_type": "popup",
+        "trigger_type": "exit_intent",
+        "trigger_delay": 0,
+        "trigger_scroll_percentage": 50,
+        "target_pages": ["/cart", "/checkout"],
+        "excluded_pages": [],
+        "settings": {
+            "position": "center",
+            "style": "modern"
+        },
+        "content": {
+            "title": "Wait! Don't miss out on savings!",
+            "message": "Add one more item and get 10% off your entire order!",
+            "cta_text": "Add to Cart",
+            "offer": "10% off entire order"
+        },
+        "expected_impact": "medium",
+        "implementation_notes": "Create exit intent popup campaign"
+    },
+)
+
+DEMO_RULES = (
+    # Rule 1: Entry-Level Cart Completion
+    {
+        "name": "Entry-Level Cart Completion ($50)",
+        "description": "Encourage customers to add one more item when cart reaches $50",
+        "trigger_type": "cart_value",
+        "trigger_conditions": {
+            "cart_value_operator": "greater_than",
+            "cart_value": 50.00
+        },
+        "target_products": [],
+        "ai_copy_id": None,
+        "display_type": "popup",
+        "display_settings": {},
+        "priority": 5,
+        "status": "draft",
+        "use_ai": False
+    },
+    # Rule 2: Mid-Range Upsell
+    {
+        "name": "Mid-Range Upsell ($100)",
+        "description": "Show premium products when cart value exceeds $100",
+        "trigger_type": "cart_value",
+        "trigger_conditions": {
+            "cart_value_operator": "greater_than",
+            "cart_value": 100.00
+        },
+        "target_products": [],
+        "ai_copy_id": None,
+        "display_type": "popup",
+        "display_settings": {},
+        "priority": 6,
+        "status": "draft",
+        "use_ai": False
+    },
+    # Rule 3: Premium Upsell
+    {
+        "name": "Premium Upsell ($200)",
+        "description": "Target high-value customers with premium product suggestions",
+        "trigger_type": "cart_value",
+        "trigger_conditions": {
+            "cart_value_operator": "greater_than",
+            "cart_value": 200.00
+        },
+        "target_products": [],
+        "ai_copy_id": None,
+        "display_type": "popup",
+        "display_settings": {},
+        "priority": 7,
+        "status": "draft",
+        "use_ai": False
+    },
+    # Rule 4: Time-Based Engagement
+    {
+        "name": "Time-Based Engagement (3+ minutes)",
+        "description": "Engage customers who spend significant time browsing",
+        "trigger_type": "time_based",
+        "trigger_conditions": {
+            "time_on_site_operator": "greater_than",
+            "time_on_site_min": 180
+        },
+        "target_products": [],
+        "ai_copy_id": None,
+        "display_type": "popup",
+        "display_settings": {},
+        "priority": 4,
+        "status": "draft",
+        "use_ai": False
+    },
+)
+
+# Demo payload sections, built once like the fallbacks above. Each
+# analysis gets its own copy of the insights and priority action, fresh lists and a fresh
+# data summary; only the rule and campaign entries are shared
+DEMO_INSIGHTS = {
+    "product_insights": [
+        {
+            "insight": "Demo mode: No real data available",
+            "impact": "medium",
+            "action": "Set up Supabase connection to get real insights"
+        }
+    ],
+    "campaign_insights": [
+        {
+            "insight": "Demo mode: No campaign data available",
+            "impact": "medium",
+            "action": "Connect to Supabase to analyze campaigns"
+        }
+    ],
+    "rule_insights": [
+        {
+            "insight": "Demo mode: No rule data available",
+            "impact": "medium",
+            "action": "Set up database connection for rule analysis"
+        }
+    ],
+    "revenue_opportunities": [
+        {
+            "opportunity": "Connect to your database",
+            "potential_impact": "Get real insights and recommendations",
+            "implementation": "Set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY environment variables"
+        }
+    ]
+}
+
+DEMO_RULE_SUGGESTIONS = (
+    {
+        "name": "Demo Cart Value Rule",
+        "description": "Example rule for cart value upsells",
+        "trigger_type": "cart_value",
+        "trigger_conditions": {
+            "cart_value_operator": "greater_than",
+            "cart_value": 50
+        },
+        "actions": {
+            "action_type": "show_campaign",
+            "campaign_id": "cart_value_upsell"
+        },
+        "priority": 5,
+        "expected_impact": "medium",
+        "implementation_notes": "This is a demo rule. Connect to Supabase for real suggestions."
+    },
+)
+
+DEMO_CAMPAIGN_SUGGESTIONS = (
+    {
+        "name": "Demo Exit Intent Campaign",
+        "description": "Example exit intent campaign",
+        "campaign_type": "popup",
+        "trigger_type": "exit_intent",
+        "trigger_delay": 0,
+        "trigger_scroll_percentage": 50,
+        "target_pages": ["/cart", "/checkout"],
+        "excluded_pages": [],
+        "settings": {
+            "position": "center",
+            "style": "modern"
+        },
+        "content": {
+            "title": "Wait! Don't miss out!",
+            "message": "Add one more item and get 10% off!",
+            "cta_text": "Add to Cart",
+            "offer": "10% off entire order"
+        },
+        "expected_impact": "medium",
+        "implementation_notes": "This is a demo campaign. Connect to Supabase for real suggestions."
+    },
+)
+
+DEMO_PRIORITY_ACTION = {
+    "name": "Set Up Database Connection",
+    "description": "Connect to Supabase to get real insights",
+    "priority": "high",
+    "action": "Set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY environment variables",
+    "type": "setup"
+}
+
+# Connected accounts with no records yet; shaped like the AI insights so clients render them the same way
+EMPTY_ACCOUNT_INSIGHTS = {
+    "customer_behavior_insights": [
+        {
+            "insight": "No orders or cart events recorded yet",
+            "impact": "high",
+            "action": "Install the tracking script so cart events are collected from your store"
+        }
+    ],
+    "performance_insights": [
+        {
+            "insight": "No campaigns or upsell rules have run yet",
+            "impact": "medium",
+            "action": "Publish a first campaign or rule to start measuring performance"
+        }
+    ],
+    "product_insights": [
+        {
+            "insight": "No products synced yet",
+            "impact": "high",
+            "action": "Sync your product catalog so suggestions can target real products"
+        }
+    ],
+    "revenue_opportunities": [
+        {
+            "opportunity": "Start collecting store data",
+            "potential_impact": "Unlocks data-driven upsell rules and campaigns",
+            "implementation": "Sync products and orders, then run the analysis again once events come in"
+        }
+    ]
+}
+
+EMPTY_ACCOUNT_PRIORITY_ACTIONS = (
+    {
+        "name": "Add Store Data",
+        "description": "Sync products and orders so the analysis has data to work with",
+        "priority": "high",
+        "action": "Connect your store or import products and orders",
+        "type": "setup"
+    },
+    {
+        "name": "Start Tracking Cart Events",
+        "description": "Cart events drive abandonment and cart value insights",
+        "priority": "medium",
+        "action": "Add the tracking script to your storefront",
+        "type": "setup"
+    },
+)
 
 class AnalysisRequest(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     user_id: str
     analysis_type: str = "comprehensive"  # comprehensive, rules_only, campaigns_only
     time_range_days: int = 30
@@ -87,14 +691,192 @@ class AnalysisResponse(BaseModel):
     priority_actions: List[Dict[str, Any]]
     data_summary: Dict[str, Any]
 
+# Structured output schemas for the rule and campaign models; Groq fills these via tool
+# calling, so responses arrive as validated objects instead of free text to parse
+class RuleSuggestion(BaseModel):
+    name: str
+    description: str = ""
+    trigger_type: Literal["cart_value", "category", "time_based"] = "cart_value"
+    trigger_conditions: Dict[str, Any] = Field(default_factory=dict)
+    target_products: List[str] = Field(default_factory=list)
+    display_type: str = "popup"
+    display_settings: Dict[str, Any] = Field(default_factory=dict)
+    priority: int = 5
+    status: str = "draft"
+
+class RuleSuggestionList(BaseModel):
+    rules: List[RuleSuggestion]
+
+class CampaignContent(BaseModel):
+    title: str
+    message: str
+    cta_text: str
+    offer: str = ""
+
+class CampaignSuggestion(BaseModel):
+    name: str
+    description: str = ""
+    campaign_type: str = "popup"
+    trigger_type: str = "exit_intent"
+    trigger_delay: int = 0
+    trigger_scroll_percentage: int = 50
+    target_pages: List[str] = Field(default_factory=list)
+    excluded_pages: List[str] = Field(default_factory=list)
+    settings: Dict[str, Any] = Field(default_factory=dict)
+    content: CampaignContent
+    expected_impact: Literal["high", "medium", "low"] = "medium"
+    implementation_notes: str = ""
+
+class CampaignSuggestionList(BaseModel):
+    campaigns: List[CampaignSuggestion]
+
+# The insights model answers in JSON mode instead; its text is parsed and validated in one
+# pass by pydantic-core. Missing sections default to empty and unknown keys are kept.
+class Insight(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    
+    insight: str = ""
+    impact: str = "medium"
+    action: str = ""
+
+class RevenueOpportunity(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    
+    opportunity: str = ""
+    potential_impact: str = ""
+    implementation: str = ""
+
+class InsightsReport(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    
+    customer_behavior_insights: List[Insight] = Field(default_factory=list)
+    performance_insights: List[Insight] = Field(default_factory=list)
+    product_insights: List[Insight] = Field(default_factory=list)
+    revenue_opportunities: List[RevenueOpportunity] = Field(default_factory=list)
+
 class CoralResearchAgent:
+    __slots__ = ("model", "fast_model", "supabase", "db_pool", "metrics", "bundle_rpc")
+    
     def __init__(self):
         self.model = model
+        self.fast_model = fast_model
         self.supabase = supabase
+        self.db_pool = None  # asyncpg pool, set at startup when SUPABASE_DB_URL is configured
+        self.metrics = None  # MetricAggregator, set at startup when a Postgres pool is configured
+        # Fetch every table in one analyze_bundle() call (see DATABASE_MIGRATION_GUIDE.md)
+        self.bundle_rpc = os.getenv("ANALYSIS_BUNDLE_RPC", "").lower() in ("1", "true", "yes")
+    
+    def _prepare_prompt(self, prompt_name: str, **variables: str) -> tuple[list, str]:
+        """Format a named prompt and return its messages with a digest of the prompt inputs
+        
+        The digest is taken over the already-serialized variables, so cache lookups never
+        re-hash the rendered messages.
+        """
+        messages = PROMPTS[prompt_name].format_messages(**variables)
+        payload = orjson.dumps([prompt_name, variables], option=orjson.OPT_SORT_KEYS)
+        return messages, hashlib.blake2b(payload, digest_size=16).hexdigest()
+    
+    def _shape_key(self, prompt_name: str, user_id: str, *inputs: Any) -> str:
+        """Digest of a prompt's inputs reduced to their shape, scoped to one user
+        
+        Scoping keeps one store's product IDs and names out of another store's suggestions.
+        """
+        payload = orjson.dumps([prompt_name, user_id, shape_of(inputs)], default=str, option=orjson.OPT_SORT_KEYS)
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+    
+    def _llm_cache_key(self, prompt_key: str, llm=None, schema=None) -> str:
+        """Cache key for a prepared prompt sent to the given model (the insights model by default)"""
+        llm = llm or self.model
+        return f"{getattr(llm, 'model_name', None)}:{schema.__name__ if schema else ''}:{prompt_key}"
+    
+    async def _cached_invoke(self, messages: list, prompt_key: str, llm=None, refresh: bool = False, schema=None, shape_key: Optional[str] = None):
+        """Invoke the model, reusing the response for identical recent prompts
+        
+        With a shape_key, a response for a recent prompt of the same shape is reused too.
+        Returns the response content, or with a pydantic schema the validated output as a dict.
+        """
+        llm = llm or self.model
+        cache_key = self._llm_cache_key(prompt_key, llm, schema)
+        shape_cache_key = self._llm_cache_key(shape_key, llm, schema) if shape_key else None
+        if not refresh:
+            cached_content = await llm_response_cache.get(cache_key)
+            if cached_content is not None:
+                logger.info("Using cached AI response")
+                return cached_content
+            if shape_cache_key:
+                cached_content = await llm_shape_cache.get(shape_cache_key)
+                if cached_content is not None:
+                    logger.info("Using cached AI response for similarly shaped data")
+                    return cached_content
+        
+        async with groq_breaker:
+            if schema:
+                content = (await llm.with_structured_output(schema).ainvoke(messages)).model_dump()
+            else:
+                content = (await llm.ainvoke(messages)).content
+        await llm_response_cache.set(cache_key, content)
+        if shape_cache_key:
+            await llm_shape_cache.set(shape_cache_key, content)
+        return content
+    
+    async def _forget_response(self, prompt_key: str, llm=None, schema=None, shape_key: Optional[str] = None) -> None:
+        """Drop a cached response that turned out to be unusable, so it is not served again"""
+        await llm_response_cache.delete(self._llm_cache_key(prompt_key, llm, schema))
+        if shape_key:
+            await llm_shape_cache.delete(self._llm_cache_key(shape_key, llm, schema))
         
     async def analyze_user_data(self, user_id: str, time_range_days: int = 30, sent_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Analyze user's data and generate insights - AI ONLY, NO FALLBACKS"""
-        logger.info(f"Starting AI analysis for user {user_id}")
+        payload = orjson.dumps([user_id, time_range_days, sent_data], default=str, option=orjson.OPT_SORT_KEYS)
+        key = hashlib.blake2b(payload, digest_size=16).hexdigest()
+        
+        entry = await analysis_cache.get(key)
+        if entry is not None:
+            if time.time() - entry["created_at"] >= ANALYSIS_FRESH_SECONDS:
+                # Stale: answer from cache now and refresh in the background
+                logger.info("Returning stale analysis for user %s, refreshing in background", user_id)
+                self._analysis_task(key, user_id, time_range_days, sent_data).add_done_callback(log_refresh_failure)
+            else:
+                logger.info("Returning cached analysis for user %s", user_id)
+            return entry["result"]
+        
+        # Shield so one caller giving up does not cancel the run for the others
+        return await asyncio.shield(self._analysis_task(key, user_id, time_range_days, sent_data))
+    
+    def _analysis_task(self, key: str, user_id: str, time_range_days: int, sent_data: Optional[Dict[str, Any]]) -> asyncio.Task:
+        """Return the in-flight analysis run for key, starting one if there is none"""
+        task = inflight_analyses.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run_analysis(key, user_id, time_range_days, sent_data))
+            inflight_analyses[key] = task
+            task.add_done_callback(lambda _: inflight_analyses.pop(key, None))
+        return task
+    
+    async def _run_analysis(self, key: str, user_id: str, time_range_days: int, sent_data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Run one full analysis and store the result in the analysis cache under key"""
+        parts = {}
+        async for field, value in self.astream_analysis(user_id, time_range_days, sent_data):
+            parts[field] = value
+        
+        result = {
+            "user_id": user_id,
+            "analysis_timestamp": datetime.now().isoformat(),
+            "insights": parts["insights"],
+            "rule_suggestions": parts["rule_suggestions"],
+            "campaign_suggestions": parts["campaign_suggestions"],
+            "priority_actions": parts["priority_actions"],
+            "data_summary": parts["data_summary"]
+        }
+        
+        logger.info("Analysis completed for user %s", user_id)
+        logger.info("Generated %s rules, %s campaigns", len(result['rule_suggestions']), len(result['campaign_suggestions']))
+        
+        await analysis_cache.set(key, {"created_at": time.time(), "result": result})
+        return result
+    
+    async def astream_analysis(self, user_id: str, time_range_days: int = 30, sent_data: Optional[Dict[str, Any]] = None):
+        """Yield (field, value) for each part of the analysis result as soon as it is ready"""
+        logger.info("Starting AI analysis for user %s", user_id)
         
         # CRITICAL: Require AI model - no fallbacks allowed
         if not self.model:
@@ -105,54 +887,92 @@ class CoralResearchAgent:
         if sent_data:
             logger.info("Using data sent from UpsellEngine")
             data = self._transform_upsell_engine_data(sent_data)
-        elif self.supabase:
+        elif self.db_pool or self.supabase:
             logger.info("Fetching data from Supabase")
-            data = await self._fetch_user_data(user_id, time_range_days)
+            data = await self._get_user_data(user_id, time_range_days)
         else:
             logger.error("CRITICAL: No data source available. Cannot generate AI insights without data.")
             raise Exception("No data source available. Please check Supabase connection or provide data.")
         
         # DEBUG: Log what data we received
-        logger.info(f"=== DATA RECEIVED DEBUG ===")
-        logger.info(f"Total data keys: {list(data.keys())}")
+        logger.info("=== DATA RECEIVED DEBUG ===")
+        logger.info("Total data keys: %s", list(data.keys()))
         for key, value in data.items():
             if isinstance(value, list):
-                logger.info(f"{key}: {len(value)} items")
+                logger.info("%s: %s items", key, len(value))
                 if value and len(value) > 0:
-                    logger.info(f"Sample {key}: {value[0]}")
+                    logger.info("Sample %s: %s", key, value[0])
             else:
-                logger.info(f"{key}: {value}")
+                logger.info("%s: %s", key, value)
         
-        # Generate insights using AI
-        logger.info("Generating insights...")
-        insights = await self._generate_insights_simple(data, user_id)
+        # Preparing very large accounts takes long enough to stall other requests, so it runs
+        # in a worker thread; below the threshold the hand-off would cost more than it saves
+        offload = sum(len(value) for value in data.values() if isinstance(value, list)) >= OFFLOAD_ROWS_THRESHOLD
         
-        # Generate rule suggestions
-        logger.info("Generating rule suggestions...")
-        rule_suggestions = await self._generate_rule_suggestions(data, insights, user_id)
-        
-        # Generate campaign suggestions
-        logger.info("Generating campaign suggestions...")
-        campaign_suggestions = await self._generate_campaign_suggestions(data, insights, user_id)
+        # Large event lists are only counted, sampled and averaged; reduce them now so the
+        # rows are freed before the LLM calls instead of living for the whole request
+        if offload:
+            await asyncio.to_thread(self._compact_event_lists, data)
+        else:
+            self._compact_event_lists(data)
+        
+        # A connected account with nothing in it yet gets the canned analysis without any LLM calls
+        total_records = sum(len(value) for value in data.values() if isinstance(value, list))
+        total_records += sum(data.get(f"{key}_count", 0) for key in COMPACTED_LISTS)
+        if not total_records:
+            logger.info("No records found for user %s, skipping AI analysis", user_id)
+            empty_result = await self._generate_empty_account_analysis(user_id, time_range_days, data)
+            for field in ("data_summary", "insights", "rule_suggestions", "campaign_suggestions", "priority_actions"):
+                yield field, empty_result[field]
+            return
+        
+        # Summarize the data once up front; the insight prompt and the response both use it
+        if offload:
+            data_summary = await asyncio.to_thread(self._create_data_summary, data)
+        else:
+            data_summary = self._create_data_summary(data)
+        yield "data_summary", data_summary
+        
+        # Generate insights, rule suggestions and campaign suggestions; each is its own focused
+        # prompt over the same data, so run all three concurrently and hand each back as soon
+        # as it finishes
+        logger.info("Generating insights, rule and campaign suggestions...")
+        tasks = {
+            asyncio.ensure_future(self._generate_insights_simple(data, user_id)): "insights",
+            asyncio.ensure_future(self._generate_rule_suggestions(data, user_id)): "rule_suggestions",
+            asyncio.ensure_future(self._generate_campaign_suggestions(data, user_id)): "campaign_suggestions"
+        }
+        results = {}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    results[tasks[task]] = task.result()
+                    yield tasks[task], results[tasks[task]]
+        finally:
+            # On failure, stop whatever is still running and mark the other outcomes as retrieved
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()
         
         # Generate priority actions
         logger.info("Generating priority actions...")
-        priority_actions = await self._generate_priority_actions(insights, rule_suggestions, campaign_suggestions)
-        
-        result = {
-            "user_id": user_id,
-            "analysis_timestamp": datetime.now().isoformat(),
-            "insights": insights,
-            "rule_suggestions": rule_suggestions,
-            "campaign_suggestions": campaign_suggestions,
-            "priority_actions": priority_actions,
-            "data_summary": self._create_data_summary(data)
-        }
-        
-        logger.info(f"Analysis completed for user {user_id}")
-        logger.info(f"Generated {len(rule_suggestions)} rules, {len(campaign_suggestions)} campaigns")
-        
-        return result
+        priority_actions = await self._generate_priority_actions(results["insights"], results["rule_suggestions"], results["campaign_suggestions"])
+        yield "priority_actions", priority_actions
+    
+    def _compact_event_lists(self, data: Dict[str, Any]) -> None:
+        """Replace each large event list in data with its count, a small sample and value stats"""
+        for key, value_field in COMPACTED_LISTS.items():
+            rows = data.pop(key, None)
+            if rows is None:
+                continue
+            data.setdefault(f"{key}_count", len(rows))
+            data[f"{key}_sample"] = rows[:SAMPLE_SIZE]
+            if value_field:
+                data[f"{key}_stats"] = value_stats(rows, value_field)
     
     def _transform_upsell_engine_data(self, sent_data: Dict[str, Any]) -> Dict[str, Any]:
         """Transform UpsellEngine data format to Coral agent format"""
@@ -170,7 +990,7 @@ class CoralResearchAgent:
             "analysis_period_days": sent_data.get("analysis_period", "30_days")
         }
         
-        logger.info(f"Transformed data: {len(transformed_data['shopify_products'])} products, {len(transformed_data['shopify_orders'])} orders")
+        logger.info("Transformed data: %s products, %s orders", len(transformed_data['shopify_products']), len(transformed_data['shopify_orders']))
         
         return transformed_data
     
@@ -181,87 +1001,10 @@ class CoralResearchAgent:
         return {
             "user_id": user_id,
             "analysis_timestamp": datetime.now().isoformat(),
-            "insights": {
-                "product_insights": [
-                    {
-                        "insight": "Demo mode: No real data available",
-                        "impact": "medium",
-                        "action": "Set up Supabase connection to get real insights"
-                    }
-                ],
-                "campaign_insights": [
-                    {
-                        "insight": "Demo mode: No campaign data available",
-                        "impact": "medium",
-                        "action": "Connect to Supabase to analyze campaigns"
-                    }
-                ],
-                "rule_insights": [
-                    {
-                        "insight": "Demo mode: No rule data available",
-                        "impact": "medium",
-                        "action": "Set up database connection for rule analysis"
-                    }
-                ],
-                "revenue_opportunities": [
-                    {
-                        "opportunity": "Connect to your database",
-                        "potential_impact": "Get real insights and recommendations",
-                        "implementation": "Set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY environment variables"
-                    }
-                ]
-            },
-            "rule_suggestions": [
-                {
-                    "name": "Demo Cart Value Rule",
-                    "description": "Example rule for cart value upsells",
-                    "trigger_type": "cart_value",
-                    "trigger_conditions": {
-                        "cart_value_operator": "greater_than",
-                        "cart_value": 50
-                    },
-                    "actions": {
-                        "action_type": "show_campaign",
-                        "campaign_id": "cart_value_upsell"
-                    },
-                    "priority": 5,
-                    "expected_impact": "medium",
-                    "implementation_notes": "This is a demo rule. Connect to Supabase for real suggestions."
-                }
-            ],
-            "campaign_suggestions": [
-                {
-                    "name": "Demo Exit Intent Campaign",
-                    "description": "Example exit intent campaign",
-                    "campaign_type": "popup",
-                    "trigger_type": "exit_intent",
-                    "trigger_delay": 0,
-                    "trigger_scroll_percentage": 50,
-                    "target_pages": ["/cart", "/checkout"],
-                    "excluded_pages": [],
-                    "settings": {
-                        "position": "center",
-                        "style": "modern"
-                    },
-                    "content": {
-                        "title": "Wait! Don't miss out!",
-                        "message": "Add one more item and get 10% off!",
-                        "cta_text": "Add to Cart",
-                        "offer": "10% off entire order"
-                    },
-                    "expected_impact": "medium",
-                    "implementation_notes": "This is a demo campaign. Connect to Supabase for real suggestions."
-                }
-            ],
-            "priority_actions": [
-                {
-                    "name": "Set Up Database Connection",
-                    "description": "Connect to Supabase to get real insights",
-                    "priority": "high",
-                    "action": "Set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY environment variables",
-                    "type": "setup"
-                }
-            ],
+            "insights": copy.deepcopy(DEMO_INSIGHTS),
+            "rule_suggestions": list(DEMO_RULE_SUGGESTIONS),
+            "campaign_suggestions": list(DEMO_CAMPAIGN_SUGGESTIONS),
+            "priority_actions": [dict(DEMO_PRIORITY_ACTION)],
             "data_summary": {
                 "total_products": 0,
                 "total_campaigns": 0,
@@ -293,15 +1036,137 @@ class CoralResearchAgent:
         
         return demo_result
     
-    async def _fetch_user_data(self, user_id: str, time_range_days: int) -> Dict[str, Any]:
-        """Fetch all relevant data for the user in priority order"""
-        cutoff_date = datetime.now() - timedelta(days=time_range_days)
+    async def _generate_empty_account_analysis(self, user_id: str, time_range_days: int, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Generate analysis for a connected account that has no data yet"""
+        logger.info("Generating empty account analysis (no records)")
+        
+        # The summary is all zeros but keeps the profile that was actually fetched
+        data_summary = self._create_data_summary(data)
+        data_summary["mode"] = "empty"
+        data_summary["note"] = "Connected but empty: no orders, cart events, campaigns, rules or products found"
+        
+        return {
+            "user_id": user_id,
+            "analysis_timestamp": datetime.now().isoformat(),
+            "insights": copy.deepcopy(EMPTY_ACCOUNT_INSIGHTS),
+            "rule_suggestions": [],
+            "campaign_suggestions": [],
+            "priority_actions": [dict(action) for action in EMPTY_ACCOUNT_PRIORITY_ACTIONS],
+            "data_summary": data_summary
+        }
+    
+    async def _select(self, table: str, column: str, value: str, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Select rows where column = value (and created_at >= since) from Postgres directly or through Supabase"""
+        columns = FETCH_COLUMNS.get(table, '*')
+        if self.db_pool:
+            sql = f"SELECT {columns} FROM {table} WHERE {column} = $1"
+            params = [value]
+            if since:
+                sql += " AND created_at >= $2"
+                params.append(since)
+            rows = await self.db_pool.fetch(sql, *params)
+            return [record_to_dict(row) for row in rows]
+        
+        query = self.supabase.table(table).select(columns).eq(column, value)
+        if since:
+            query = query.gte('created_at', since.isoformat())
+        response = await query.execute()
+        return response.data if response.data else []
+    
+    async def _count(self, table: str, column: str, value: str, since: Optional[datetime] = None) -> int:
+        """Count rows where column = value (and created_at >= since) without transferring them"""
+        if self.db_pool:
+            sql = f"SELECT count(*) FROM {table} WHERE {column} = $1"
+            params = [value]
+            if since:
+                sql += " AND created_at >= $2"
+                params.append(since)
+            return await self.db_pool.fetchval(sql, *params)
+        
+        query = self.supabase.table(table).select('id', count='exact', head=True).eq(column, value)
+        if since:
+            query = query.gte('created_at', since.isoformat())
+        response = await query.execute()
+        return response.count or 0
+    
+    async def _aggregate(self, table: str, value_field: str, user_id: str, since: datetime) -> Dict[str, Any]:
+        """Row count and value_stats of value_field for a user's rows since the given time"""
+        if self.db_pool:
+            row = await self.db_pool.fetchrow(
+                f"SELECT count(*) AS row_count, count(NULLIF({value_field}, 0)) AS value_count, "
+                f"coalesce(sum({value_field}), 0) AS value_total, min(NULLIF({value_field}, 0)) AS value_min, "
+                f"max(NULLIF({value_field}, 0)) AS value_max FROM {table} WHERE user_id = $1 AND created_at >= $2",
+                user_id, since
+            )
+            stats = {key: float(row[f"value_{key}"] or 0) for key in ("total", "min", "max")}
+            return {"rows": row["row_count"], "stats": {"count": row["value_count"], **stats}}
+        
+        rows = await self._select(table, 'user_id', user_id, since=since)
+        return {"rows": len(rows), "stats": value_stats(rows, value_field)}
+    
+    async def _fetch_event_metrics(self, user_id: str, time_range_days: int) -> Dict[str, Any]:
+        """Order, cart and upsell event rollups in the shape _compact_event_lists produces"""
+        since = datetime.now(timezone.utc) - timedelta(days=time_range_days)
+        orders, cart_events, upsell_events_count = await asyncio.gather(
+            self._aggregate('shopify_orders', 'total_price', user_id, since),
+            self._aggregate('cart_events', 'cart_total', user_id, since),
+            self._count('upsell_events', 'user_id', user_id, since=since)
+        )
+        return {
+            "shopify_orders_count": orders["rows"],
+            "shopify_orders_stats": orders["stats"],
+            "cart_events_count": cart_events["rows"],
+            "cart_events_stats": cart_events["stats"],
+            "upsell_events_count": upsell_events_count
+        }
+    
+    async def _fetch_bundle(self, user_id: str, time_range_days: int, include_events: bool) -> Dict[str, Any]:
+        """All tables _fetch_user_data reads, from a single analyze_bundle() database call"""
+        if self.db_pool:
+            return await self.db_pool.fetchval(
+                "SELECT analyze_bundle($1::uuid, $2, $3)", user_id, time_range_days, include_events
+            )
+        
+        response = await self.supabase.rpc(
+            'analyze_bundle', {"uid": user_id, "d": time_range_days, "include_events": include_events}
+        ).execute()
+        return response.data
+    
+    async def _get_user_data(self, user_id: str, time_range_days: int) -> Dict[str, Any]:
+        """_fetch_user_data through the short-lived user data cache
+        
+        Returns a shallow copy, since the analysis compacts and annotates the dict it is given.
+        """
+        key = f"{user_id}:{time_range_days}"
+        data = await user_data_cache.get(key)
+        if data is None:
+            task = inflight_fetches.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self._fetch_user_data(user_id, time_range_days))
+                inflight_fetches[key] = task
+                task.add_done_callback(lambda _: inflight_fetches.pop(key, None))
+            data = await asyncio.shield(task)
+            await user_data_cache.set(key, data)
+        else:
+            logger.info("Using cached data for user %s", user_id)
+        return dict(data)
+    
+    async def _fetch_user_data(self, user_id: str, time_range_days: int, use_metrics: bool = True) -> Dict[str, Any]:
+        """Fetch all relevant data for the user, querying every table concurrently
+        
+        When the metric aggregator has fresh rollups for this user and range, the order, cart
+        and upsell event tables are not queried at all.
+        """
+        # created_at is timestamptz, so the cutoff is UTC-aware rather than in the host's local time
+        cutoff_date = datetime.now(timezone.utc) - timedelta(days=time_range_days)
+        metrics = self.metrics.get(user_id, time_range_days) if use_metrics and self.metrics else None
         
         try:
             data = {
                 "shopify_orders": [],
                 "cart_events": [],
                 "upsell_events": [],
+                "upsell_events_count": 0,
                 "campaigns": [],
                 "shopify_products": [],
                 "upsell_rules": [],
@@ -309,99 +1174,80 @@ class CoralResearchAgent:
                 "analysis_period_days": time_range_days
             }
             
-            logger.info(f"Starting data fetch for user {user_id} (last {time_range_days} days)")
+            logger.info("Starting data fetch for user %s (last %s days)", user_id, time_range_days)
             
-            # 1. CUSTOMER BEHAVIOR (Priority 1)
-            logger.info("1. Fetching customer behavior data...")
-            
-            # Shopify Orders
-            try:
-                orders_response = self.supabase.table('shopify_orders').select('*').eq('user_id', user_id).gte('created_at', cutoff_date.isoformat()).execute()
-                data["shopify_orders"] = orders_response.data if orders_response.data else []
-                logger.info(f"Found {len(data['shopify_orders'])} shopify_orders")
-            except Exception as e:
-                logger.warning(f"Could not fetch shopify_orders: {str(e)}")
-            
-            # Cart Events
-            try:
-                cart_events_response = self.supabase.table('cart_events').select('*').eq('user_id', user_id).gte('created_at', cutoff_date.isoformat()).execute()
-                data["cart_events"] = cart_events_response.data if cart_events_response.data else []
-                logger.info(f"Found {len(data['cart_events'])} cart_events")
-            except Exception as e:
-                logger.warning(f"Could not fetch cart_events: {str(e)}")
-            
-            # 2. CURRENT PERFORMANCE (Priority 2)
-            logger.info("2. Fetching current performance data...")
-            
-            # Upsell Events
-            try:
-                upsell_events_response = self.supabase.table('upsell_events').select('*').eq('user_id', user_id).gte('created_at', cutoff_date.isoformat()).execute()
-                data["upsell_events"] = upsell_events_response.data if upsell_events_response.data else []
-                logger.info(f"Found {len(data['upsell_events'])} upsell_events")
-            except Exception as e:
-                logger.warning(f"Could not fetch upsell_events: {str(e)}")
-            
-            # Campaigns
-            try:
-                campaigns_response = self.supabase.table('campaigns').select('*').eq('user_id', user_id).execute()
-                data["campaigns"] = campaigns_response.data if campaigns_response.data else []
-                logger.info(f"Found {len(data['campaigns'])} campaigns")
-            except Exception as e:
-                logger.warning(f"Could not fetch campaigns: {str(e)}")
+            async def fetch_products():
+                # Try products table first (your primary table), Shopify table as fallback
+                try:
+                    return await self._select('products', 'user_id', user_id)
+                except Exception as e:
+                    logger.warning("Could not fetch products: %s", e)
+                    return await self._select('shopify_products', 'user_id', user_id)
             
-            # 3. PRODUCT DATA (Priority 3)
-            logger.info("3. Fetching product data...")
+            if metrics:
+                logger.info("Using precomputed order, cart and upsell metrics")
+                for key in COMPACTED_LISTS:
+                    data.pop(key)
+                data.update(metrics)
             
-            # Try products table first (your primary table)
-            try:
-                products_response = self.supabase.table('products').select('*').eq('user_id', user_id).execute()
-                data["shopify_products"] = products_response.data if products_response.data else []
-                logger.info(f"Found {len(data['shopify_products'])} products")
-            except Exception as e:
-                logger.warning(f"Could not fetch products: {str(e)}")
-                # Try Shopify table as fallback
+            if self.bundle_rpc:
                 try:
-                    products_response = self.supabase.table('shopify_products').select('*').eq('user_id', user_id).execute()
-                    data["shopify_products"] = products_response.data if products_response.data else []
-                    logger.info(f"Found {len(data['shopify_products'])} shopify_products (fallback)")
-                except Exception as e2:
-                    logger.warning(f"Could not fetch shopify_products either: {str(e2)}")
-            
-            # Additional data for context
-            logger.info("4. Fetching additional context data...")
+                    bundle = await self._fetch_bundle(user_id, time_range_days, include_events=not metrics)
+                except Exception as e:
+                    logger.warning("analyze_bundle failed, querying tables individually: %s", e)
+                else:
+                    # Event entries are null when the precomputed metrics are used instead
+                    data.update((key, value) for key, value in bundle.items() if value is not None)
+                    data["profiles"] = bundle.get("profiles") or {}
+                    logger.info("Data fetch completed in one call for user %s", user_id)
+                    return data
             
-            # Upsell Rules
-            try:
-                rules_response = self.supabase.table('upsell_rules').select('*').eq('user_id', user_id).execute()
-                data["upsell_rules"] = rules_response.data if rules_response.data else []
-                logger.info(f"Found {len(data['upsell_rules'])} upsell_rules")
-            except Exception as e:
-                logger.warning(f"Could not fetch upsell_rules: {str(e)}")
+            # Wait on every table together rather than one round-trip after another
+            queries = {} if metrics else {
+                # 1. CUSTOMER BEHAVIOR
+                "shopify_orders": self._select('shopify_orders', 'user_id', user_id, since=cutoff_date),
+                "cart_events": self._select('cart_events', 'user_id', user_id, since=cutoff_date),
+                # 2. CURRENT PERFORMANCE (upsell events are only ever counted)
+                "upsell_events_count": self._count('upsell_events', 'user_id', user_id, since=cutoff_date),
+            }
+            queries.update({
+                "campaigns": self._select('campaigns', 'user_id', user_id),
+                # 3. PRODUCT DATA
+                "shopify_products": fetch_products(),
+                # 4. ADDITIONAL CONTEXT
+                "upsell_rules": self._select('upsell_rules', 'user_id', user_id),
+                "profiles": self._select('profiles', 'id', user_id),
+            })
+            results = await asyncio.gather(*queries.values(), return_exceptions=True)
             
-            # User Profile
-            try:
-                profile_response = self.supabase.table('profiles').select('*').eq('id', user_id).execute()
-                data["profiles"] = profile_response.data[0] if profile_response.data else {}
-                logger.info("Found user profile")
-            except Exception as e:
-                logger.warning(f"Could not fetch profile: {str(e)}")
-                data["profiles"] = {}
+            for key, rows in zip(queries, results):
+                if isinstance(rows, Exception):
+                    # An unreachable database fails the request; a missing table only leaves a gap
+                    if is_transient(rows):
+                        raise rows
+                    logger.warning("Could not fetch %s: %s", key, rows)
+                elif key == "profiles":
+                    data["profiles"] = rows[0] if rows else {}
+                    logger.info("Found user profile")
+                elif key == "upsell_events_count":
+                    data[key] = rows
+                    logger.info("Counted %s upsell_events", rows)
+                else:
+                    data[key] = rows
+                    logger.info("Found %s %s", len(data[key]), key)
             
             # Summary
             total_records = sum(len(v) for k, v in data.items() if isinstance(v, list))
-            logger.info(f"Data fetch completed. Total records: {total_records}")
+            logger.info("Data fetch completed. Total records: %s", total_records)
             
             return data
             
         except Exception as e:
-            logger.error(f"Error fetching data: {str(e)}")
+            logger.error("Error fetching data: %s", e)
             raise HTTPException(status_code=500, detail=f"Failed to fetch user data: {str(e)}")
     
-    async def _generate_insights(self, data: Dict[str, Any], user_id: str) -> Dict[str, Any]:
-        """Generate insights from the data using AI - NO FALLBACKS ALLOWED"""
-        
-        # Create a summary of the data for AI analysis
-        data_summary = self._create_data_summary(data)
+    async def _generate_insights(self, data_summary: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+        """Generate insights from the data summary using AI - NO FALLBACKS ALLOWED"""
         
         # Ensure we have a model connection
         if not self.model:
@@ -419,40 +1265,23 @@ class CoralResearchAgent:
         #     logger.error(f"AI model test failed: {str(e)}")
         #     raise Exception(f"AI model is not responding. Please check GROQ_API_KEY and model connection: {str(e)}")
         
-        # Use plain strings instead of template formatting to avoid KeyError
-        messages = [
-            ("system", "You are a JSON generator. Return ONLY valid JSON. No text, no explanations, no markdown."),
-            ("user", f"""Generate insights JSON for this e-commerce data: {json.dumps(data_summary, indent=2)}
-
-Return this exact JSON structure:
-{{
-    "customer_behavior_insights": [
-        {{"insight": "description", "impact": "high|medium|low", "action": "specific action"}}
-    ],
-    "performance_insights": [
-        {{"insight": "description", "impact": "high|medium|low", "action": "specific action"}}
-    ],
-    "product_insights": [
-        {{"insight": "description", "impact": "high|medium|low", "action": "specific action"}}
-    ],
-    "revenue_opportunities": [
-        {{"opportunity": "description", "potential_impact": "estimated revenue increase", "implementation": "how to implement"}}
-    ]
-}}""")
-        ]
+        # Format the prompt once; retries reuse the same messages and cache key
+        llm_summary = self._create_llm_summary(data_summary)
+        messages, prompt_key = self._prepare_prompt("insights", data_summary_json=to_prompt_json(llm_summary))
         
         # Retry logic for AI insights
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                logger.info(f"Attempting AI insight generation (attempt {attempt + 1}/{max_retries})")
-                response = await self.model.ainvoke(messages)
+                logger.info("Attempting AI insight generation (attempt %s/%s)", attempt + 1, max_retries)
+                # Retries bypass the cache so a bad cached response is not parsed again
+                content = await self._cached_invoke(messages, prompt_key, refresh=attempt > 0)
                 
                 # Clean the response content
-                content = response.content.strip()
-                logger.info(f"AI response received: {content[:200]}...")
+                content = content.strip()
+                logger.info("AI response received: %s...", content[:200])
                 # EXTRA LOGGING: Print the full raw AI response for debugging
-                logger.error(f"=== RAW AI RESPONSE START ===\n{content}\n=== RAW AI RESPONSE END ===")
+                logger.error("=== RAW AI RESPONSE START ===\n%s\n=== RAW AI RESPONSE END ===", content)
                 # Remove markdown formatting if present
                 if content.startswith('```json'):
                     content = content[7:]
@@ -464,13 +1293,14 @@ Return this exact JSON structure:
                 insights = None
                 json_error = None
                 
-                # Strategy 1: Direct JSON parsing
+                # Strategy 1: Direct parsing and validation in a single pass
                 try:
-                    insights = json.loads(content)
+                    insights = InsightsReport.model_validate_json(content).model_dump()
                     logger.info("Strategy 1: Direct JSON parsing successful")
-                except json.JSONDecodeError as e:
+                    return insights
+                except ValidationError as e:
                     json_error = e
-                    logger.warning(f"Strategy 1 failed: {e}")
+                    logger.warning("Strategy 1 failed: %s", e)
                 
                 # Strategy 2: Clean and try again
                 if insights is None:
@@ -484,10 +1314,10 @@ Return this exact JSON structure:
                         if cleaned_content.startswith('`') and cleaned_content.endswith('`'):
                             cleaned_content = cleaned_content[1:-1]
                         
-                        insights = json.loads(cleaned_content)
+                        insights = orjson.loads(cleaned_content)
                         logger.info("Strategy 2: Cleaned JSON parsing successful")
                     except json.JSONDecodeError as e:
-                        logger.warning(f"Strategy 2 failed: {e}")
+                        logger.warning("Strategy 2 failed: %s", e)
                 
                 # Strategy 3: Extract JSON object with regex
                 if insights is None:
@@ -497,10 +1327,10 @@ Return this exact JSON structure:
                         json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', content, re.DOTALL)
                         if json_match:
                             extracted_json = json_match.group()
-                            insights = json.loads(extracted_json)
+                            insights = orjson.loads(extracted_json)
                             logger.info("Strategy 3: Regex extraction successful")
                     except (json.JSONDecodeError, AttributeError) as e:
-                        logger.warning(f"Strategy 3 failed: {e}")
+                        logger.warning("Strategy 3 failed: %s", e)
                 
                 # Strategy 4: Try to fix common JSON issues
                 if insights is None:
@@ -512,10 +1342,10 @@ Return this exact JSON structure:
                         # Ensure proper quote formatting
                         fixed_content = re.sub(r'([{,])\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*:', r'\1 "\2":', fixed_content)
                         
-                        insights = json.loads(fixed_content)
+                        insights = orjson.loads(fixed_content)
                         logger.info("Strategy 4: Fixed JSON parsing successful")
                     except json.JSONDecodeError as e:
-                        logger.warning(f"Strategy 4 failed: {e}")
+                        logger.warning("Strategy 4 failed: %s", e)
                 
                 # Strategy 5: Handle when AI returns just a string or partial JSON
                 if insights is None:
@@ -534,12 +1364,12 @@ Return this exact JSON structure:
                                 "product_insights": [{"insight": "AI response incomplete", "impact": "medium", "action": "Retry analysis"}],
                                 "revenue_opportunities": [{"opportunity": "AI response incomplete", "potential_impact": "Unknown", "implementation": "Retry analysis"}]
                             }
-                            logger.info(f"Strategy 5: Constructed JSON from string response: {key_name}")
+                            logger.info("Strategy 5: Constructed JSON from string response: %s", key_name)
                         # If AI returned partial JSON like '{"customer_behavior":', try to complete it
                         elif cleaned_content.startswith('{') and not cleaned_content.endswith('}'):
                             # Try to complete the JSON with default structure
                             completed_content = cleaned_content + '": [{"insight": "AI response incomplete", "impact": "medium", "action": "Retry analysis"}]}'
-                            insights = json.loads(completed_content)
+                            insights = orjson.loads(completed_content)
                             logger.info("Strategy 5: Completed partial JSON response")
                         # If AI returned something like '\n  "customer_behavior"' (with newlines and spaces)
                         elif '"' in cleaned_content and cleaned_content.count('"') == 2:
@@ -554,35 +1384,26 @@ Return this exact JSON structure:
                                     "product_insights": [{"insight": "AI response incomplete", "impact": "medium", "action": "Retry analysis"}],
                                     "revenue_opportunities": [{"opportunity": "AI response incomplete", "potential_impact": "Unknown", "implementation": "Retry analysis"}]
                                 }
-                                logger.info(f"Strategy 5: Constructed JSON from messy string response: {key_name}")
+                                logger.info("Strategy 5: Constructed JSON from messy string response: %s", key_name)
                     except Exception as e:
-                        logger.warning(f"Strategy 5 failed: {e}")
+                        logger.warning("Strategy 5 failed: %s", e)
                 
                 # If all strategies failed, log the content and raise error
                 if insights is None:
-                    logger.error(f"All JSON parsing strategies failed. Content: {content}")
-                    logger.error(f"Original JSON error: {json_error}")
+                    logger.error("All JSON parsing strategies failed. Content: %s", content)
+                    logger.error("Original JSON error: %s", json_error)
                     
                     if attempt == max_retries - 1:
                         raise Exception(f"Failed to parse AI response after {max_retries} attempts. Content: {content[:200]}...")
                     continue
                 
-                # Validate the insights structure
-                required_keys = ["customer_behavior_insights", "performance_insights", "product_insights", "revenue_opportunities"]
-                if all(key in insights for key in required_keys):
-                    logger.info("AI insights validation successful")
-                    return insights
-                else:
-                    logger.warning(f"AI insights missing required keys. Found: {list(insights.keys())}")
-                    # Try to fix missing keys with default values
-                    for key in required_keys:
-                        if key not in insights:
-                            insights[key] = []
-                    logger.info("Added missing keys with default values")
-                    return insights
+                # Validate the repaired insights; missing sections default to empty lists
+                insights = InsightsReport.model_validate(insights).model_dump()
+                logger.info("AI insights validation successful")
+                return insights
                     
             except Exception as e:
-                logger.error(f"AI insight generation failed on attempt {attempt + 1}: {str(e)}")
+                logger.error("AI insight generation failed on attempt %s: %s", attempt + 1, e)
                 if attempt == max_retries - 1:
                     logger.error("CRITICAL: All AI insight generation attempts failed. Cannot proceed without AI insights.")
                     raise Exception(f"AI insight generation failed after {max_retries} attempts: {str(e)}")
@@ -591,7 +1412,7 @@ Return this exact JSON structure:
         # This should never be reached, but just in case
         raise Exception("AI insight generation failed - unexpected error")
     
-    async def _generate_rule_suggestions(self, data: Dict[str, Any], insights: Dict[str, Any], user_id: str) -> List[Dict[str, Any]]:
+    async def _generate_rule_suggestions(self, data: Dict[str, Any], user_id: str) -> List[Dict[str, Any]]:
         """Generate specific upsell rule suggestions based on actual data analysis"""
         
         # First, let's analyze the actual data to create data-driven rules
@@ -600,7 +1421,7 @@ Return this exact JSON structure:
         # Create a much simpler, more focused prompt using plain messages
         # Include product information so AI can generate matching rule names
         products_info = []
-        for product in data.get('shopify_products', [])[:10]:  # Limit to first 10 products
+        for product in first_by_id(data.get('shopify_products', []), 10):  # Limit to 10 products
             products_info.append({
                 'id': product.get('id'),
                 'title': product.get('title', 'Unknown'),
@@ -608,74 +1429,20 @@ Return this exact JSON structure:
                 'product_type': product.get('product_type', 'general')
             })
         
-        messages = [
-            ("system", "You are a JSON generator. Return ONLY valid JSON. No text, no explanations, no markdown."),
-            ("user", f"""Generate upsell rules JSON for this business data: {json.dumps(data_analysis, indent=2)}
-
-Available products for targeting:
-{json.dumps(products_info, indent=2)}
-
-CRITICAL INSTRUCTIONS:
-1. Use ONLY product names from the available products list above
-2. Do NOT invent product names that don't exist
-3. If you reference a product in the rule name, include its ID in target_products
-4. Keep rule names concise and product-focused
-
-Return this exact JSON array format:
-[
-  {{
-    "name": "Product Name Upsell (use actual product names only)",
-    "description": "Upsell for [actual product name]",
-    "trigger_type": "cart_value|category|time_based",
-    "trigger_conditions": {{
-      "cart_value_operator": "greater_than",
-      "cart_value": 100.00
-    }},
-    "target_products": ["product_id_1", "product_id_2"],
-    "display_type": "popup",
-    "display_settings": {{}},
-    "priority": 4,
-    "status": "draft"
-  }}
-]""")
-        ]
+        messages, prompt_key = self._prepare_prompt(
+            "rules",
+            data_analysis_json=to_prompt_json(data_analysis),
+            products_json=to_prompt_json(products_info)
+        )
+        # Rules name products and thresholds rather than quoting counts, so slightly drifted data may share them
+        shape_key = self._shape_key("rules", user_id, data_analysis, products_info)
         
         try:
-            response = await self.model.ainvoke(messages)
-            
-            # Clean and parse the response
-            content = response.content.strip()
-            logger.info(f"AI response content: {content[:200]}...")  # Log first 200 chars
-            
-            # Remove any markdown formatting
-            if content.startswith('```json'):
-                content = content[7:]
-            if content.endswith('```'):
-                content = content[:-3]
-            content = content.strip()
+            output = await self._cached_invoke(messages, prompt_key, self.fast_model, schema=RuleSuggestionList, shape_key=shape_key)
+            rules = output["rules"]
             
-            # Try to parse the JSON
-            try:
-                rules = json.loads(content)
-            except json.JSONDecodeError as json_error:
-                logger.error(f"JSON parsing error: {json_error}")
-                logger.error(f"Content that failed to parse: {content}")
-                # Try to extract JSON from the response
-                import re
-                json_match = re.search(r'\[.*\]', content, re.DOTALL)
-                if json_match:
-                    try:
-                        rules = json.loads(json_match.group())
-                        logger.info("Successfully extracted JSON from response")
-                    except:
-                        logger.error("Failed to extract JSON from AI response. AI rules are required.")
-                        raise Exception("AI rule generation failed: Could not extract JSON from AI response.")
-                else:
-                    logger.error("No JSON array found in AI response. AI rules are required.")
-                    raise Exception("AI rule generation failed: No JSON array found in AI response.")
-            
-            if isinstance(rules, list) and len(rules) > 0:
-                logger.info(f"Successfully generated {len(rules)} AI-driven rules")
+            if rules:
+                logger.info("Successfully generated %s AI-driven rules", len(rules))
                 
                 # Process each rule to ensure it matches UpsellEngine schema
                 processed_rules = []
@@ -686,7 +1453,7 @@ Return this exact JSON array format:
                 
                 # Log the exact JSON structure being returned
                 for i, rule in enumerate(processed_rules):
-                    logger.info(f"Rule {i+1} JSON structure: {json.dumps(rule, indent=2)}")
+                    logger.info("Rule %s JSON structure: %s", i+1, orjson.dumps(rule, option=orjson.OPT_INDENT_2).decode())
                 
                 return processed_rules
             else:
@@ -694,7 +1461,8 @@ Return this exact JSON array format:
                 raise Exception("AI rule generation failed: AI returned empty or invalid rules.")
                 
         except Exception as e:
-            logger.error(f"Error generating AI rules: {str(e)}")
+            await self._forget_response(prompt_key, self.fast_model, RuleSuggestionList, shape_key)
+            logger.error("Error generating AI rules: %s", e)
             logger.error("CRITICAL: AI rules are required. No fallback allowed.")
             raise Exception(f"AI rule generation failed: {str(e)}")
     
@@ -730,7 +1498,7 @@ Return this exact JSON array format:
             if rule_name_products:
                 # Use products mentioned in the rule name
                 processed_rule["target_products"] = rule_name_products
-                logger.info(f"Matched products from rule name: {rule_name_products}")
+                logger.info("Matched products from rule name: %s", rule_name_products)
             else:
                 # Fall back to intelligent product selection
                 processed_rule["target_products"] = self._select_target_products(
@@ -782,7 +1550,7 @@ Return this exact JSON array format:
         for product_name, product_id in product_mapping.items():
             if product_name in rule_name_lower and product_id:
                 matched_products.append(product_id)
-                logger.info(f"Matched product '{product_name}' from rule name '{rule_name}'")
+                logger.info("Matched product '%s' from rule name '%s'", product_name, rule_name)
         
         # Remove duplicates while preserving order
         seen = set()
@@ -827,7 +1595,7 @@ Return this exact JSON array format:
         rule["name"] = new_rule_name
         rule["description"] = new_description
         
-        logger.info(f"Updated rule name to match products: '{new_rule_name}' for products: {selected_product_names}")
+        logger.info("Updated rule name to match products: '%s' for products: %s", new_rule_name, selected_product_names)
         
         return rule
     
@@ -893,64 +1661,56 @@ Return this exact JSON array format:
         """Analyze actual data to create data-driven insights"""
         
         products = data.get('shopify_products', [])
-        orders = data.get('shopify_orders', [])
-        cart_events = data.get('cart_events', [])
+        order_count = data.get('shopify_orders_count', 0)
+        cart_event_count = data.get('cart_events_count', 0)
+        order_stats = data.get('shopify_orders_stats', value_stats([], 'total_price'))
+        cart_stats = data.get('cart_events_stats', value_stats([], 'cart_total'))
         
         # DEBUG: Log raw data
-        logger.info(f"=== DATA ANALYSIS DEBUG ===")
-        logger.info(f"Raw products count: {len(products)}")
-        logger.info(f"Raw orders count: {len(orders)}")
-        logger.info(f"Raw cart_events count: {len(cart_events)}")
+        logger.info("=== DATA ANALYSIS DEBUG ===")
+        logger.info("Raw products count: %s", len(products))
+        logger.info("Raw orders count: %s", order_count)
+        logger.info("Raw cart_events count: %s", cart_event_count)
         
         if products:
-            logger.info(f"Sample product: {products[0]}")
-        if orders:
-            logger.info(f"Sample order: {orders[0]}")
-        if cart_events:
-            logger.info(f"Sample cart event: {cart_events[0]}")
+            logger.info("Sample product: %s", products[0])
+        if data.get('shopify_orders_sample'):
+            logger.info("Sample order: %s", data['shopify_orders_sample'][0])
+        if data.get('cart_events_sample'):
+            logger.info("Sample cart event: %s", data['cart_events_sample'][0])
         
         # Analyze product pricing
-        prices = [p.get('price', 0) for p in products if p.get('price')]
-        logger.info(f"Product prices found: {len(prices)} out of {len(products)} products")
-        logger.info(f"Price values: {prices[:5]}")  # Show first 5 prices
-        
-        price_analysis = {
-            'min': min(prices) if prices else 0,
-            'max': max(prices) if prices else 0,
-            'average': sum(prices) / len(prices) if prices else 0,
-            'count': len(prices)
-        }
-        logger.info(f"Price analysis: {price_analysis}")
+        price_analysis = self._price_stats(data)
+        logger.info("Product prices found: %s out of %s products", price_analysis['count'], len(products))
+        logger.info("Price analysis: %s", price_analysis)
         
         # Analyze order patterns
-        order_totals = [o.get('total_price', 0) for o in orders if o.get('total_price')]
-        logger.info(f"Order totals found: {len(order_totals)} out of {len(orders)} orders")
-        logger.info(f"Order total values: {order_totals[:5]}")  # Show first 5 order totals
+        logger.info("Order totals found: %s out of %s orders", order_stats['count'], order_count)
         
         order_analysis = {
-            'total_orders': len(orders),
-            'avg_order_value': sum(order_totals) / len(order_totals) if order_totals else 0,
-            'min_order': min(order_totals) if order_totals else 0,
-            'max_order': max(order_totals) if order_totals else 0
+            'total_orders': order_count,
+            'avg_order_value': order_stats['total'] / order_stats['count'] if order_stats['count'] else 0,
+            'min_order': order_stats['min'],
+            'max_order': order_stats['max']
         }
-        logger.info(f"Order analysis: {order_analysis}")
+        logger.info("Order analysis: %s", order_analysis)
         
         # Analyze cart behavior
         cart_analysis = {
-            'total_cart_events': len(cart_events),
-            'abandonment_rate': self._calculate_abandonment_rate(cart_events, orders),
-            'avg_cart_value': self._calculate_avg_cart_value(cart_events)
+            'total_cart_events': cart_event_count,
+            'abandonment_rate': self._calculate_abandonment_rate(cart_event_count, order_count),
+            'avg_cart_value': self._calculate_avg_cart_value(cart_stats)
         }
-        logger.info(f"Cart analysis: {cart_analysis}")
+        logger.info("Cart analysis: %s", cart_analysis)
         
         # Sample product names for context
-        sample_products = [p.get('title', 'Unknown')[:20] for p in products[:3]]
-        logger.info(f"Sample products: {sample_products}")
+        sample_products = [p.get('title', 'Unknown')[:20] for p in first_by_id(products, 3)]
+        logger.info("Sample products: %s", sample_products)
         
         analysis_result = {
             'price_range': price_analysis,
-            'total_orders': len(orders),
-            'total_cart_events': len(cart_events),
+            'total_orders': order_count,
+            'total_cart_events': cart_event_count,
             'existing_campaigns': len(data.get('campaigns', [])),
             'existing_rules': len(data.get('upsell_rules', [])),
             'sample_products': sample_products,
@@ -958,8 +1718,8 @@ Return this exact JSON array format:
             'cart_patterns': cart_analysis
         }
         
-        logger.info(f"=== FINAL ANALYSIS RESULT ===")
-        logger.info(f"Analysis result: {json.dumps(analysis_result, indent=2)}")
+        logger.info("=== FINAL ANALYSIS RESULT ===")
+        logger.info("Analysis result: %s", orjson.dumps(analysis_result, option=orjson.OPT_INDENT_2).decode())
         
         return analysis_result
     
@@ -981,38 +1741,38 @@ Return this exact JSON array format:
             logger.warning("No valid products with ID and price found")
             return []
         available_products.sort(key=lambda x: x['price'])
-        logger.info(f"Available products for selection: {len(available_products)} products")
-        logger.info(f"Product price range: ${available_products[0]['price']} - ${available_products[-1]['price']}")
+        logger.info("Available products for selection: %s products", len(available_products))
+        logger.info("Product price range: $%s - $%s", available_products[0]['price'], available_products[-1]['price'])
         
         if rule_type == "cart_value":
             # Use the correct key for cart value
             cart_threshold = conditions.get('cart_value', 0)
             if isinstance(cart_threshold, list):
                 cart_threshold = cart_threshold[-1]  # Use upper bound for between
-            logger.info(f"Cart threshold for product selection: ${cart_threshold}")
-            logger.info(f"Average product price: ${analysis['price_range']['average']}")
+            logger.info("Cart threshold for product selection: $%s", cart_threshold)
+            logger.info("Average product price: $%s", analysis['price_range']['average'])
             
             if cart_threshold > analysis['price_range']['average'] * 1.2:
                 premium_products = [p for p in available_products if p['price'] > analysis['price_range']['average']]
                 selected_products = [p['id'] for p in premium_products[:2]]
-                logger.info(f"Selected premium products: {selected_products}")
+                logger.info("Selected premium products: %s", selected_products)
                 return selected_products
             elif cart_threshold > analysis['price_range']['average'] * 0.8:
                 mid_products = [p for p in available_products 
                               if analysis['price_range']['average'] * 0.6 <= p['price'] <= analysis['price_range']['average'] * 1.4]
                 selected_products = [p['id'] for p in mid_products[:3]]
-                logger.info(f"Selected mid-range products: {selected_products}")
+                logger.info("Selected mid-range products: %s", selected_products)
                 return selected_products
             else:
                 entry_products = [p for p in available_products if p['price'] <= analysis['price_range']['average'] * 0.8]
                 selected_products = [p['id'] for p in entry_products[:2]]
-                logger.info(f"Selected entry-level products: {selected_products}")
+                logger.info("Selected entry-level products: %s", selected_products)
                 return selected_products
         elif rule_type == "time_based":
             mid_products = [p for p in available_products 
                            if analysis['price_range']['average'] * 0.5 <= p['price'] <= analysis['price_range']['average'] * 1.5]
             selected_products = [p['id'] for p in mid_products[:3]]
-            logger.info(f"Selected time-based products: {selected_products}")
+            logger.info("Selected time-based products: %s", selected_products)
             return selected_products
         elif rule_type == "category":
             # For category rules, select products from different categories
@@ -1020,16 +1780,16 @@ Return this exact JSON array format:
             category_products = [p for p in available_products if p['category'] != target_category]
             if category_products:
                 selected_products = [p['id'] for p in category_products[:2]]
-                logger.info(f"Selected category cross-sell products: {selected_products}")
+                logger.info("Selected category cross-sell products: %s", selected_products)
                 return selected_products
             else:
                 # Fallback to general products
                 selected_products = [p['id'] for p in available_products[:2]]
-                logger.info(f"Selected fallback category products: {selected_products}")
+                logger.info("Selected fallback category products: %s", selected_products)
                 return selected_products
         else:
             selected_products = [p['id'] for p in available_products[:3]]
-            logger.info(f"Selected default products: {selected_products}")
+            logger.info("Selected default products: %s", selected_products)
             return selected_products
     
     def _generate_data_driven_rules(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -1040,14 +1800,14 @@ Return this exact JSON array format:
         existing_rules = data.get('upsell_rules', [])
         
         # Add debugging logs
-        logger.info(f"=== RULE GENERATION DEBUG ===")
-        logger.info(f"Data analysis for rules: {analysis}")
-        logger.info(f"Number of products: {len(products)}")
-        logger.info(f"Number of existing rules: {len(existing_rules)}")
+        logger.info("=== RULE GENERATION DEBUG ===")
+        logger.info("Data analysis for rules: %s", analysis)
+        logger.info("Number of products: %s", len(products))
+        logger.info("Number of existing rules: %s", len(existing_rules))
         
         # Get existing rule names to avoid duplicates
-        existing_rule_names = [rule.get('name', '') for rule in existing_rules]
-        logger.info(f"Existing rule names: {existing_rule_names}")
+        existing_rule_names = {rule.get('name', '') for rule in existing_rules}
+        logger.info("Existing rule names: %s", existing_rule_names)
         
         rules = []
         
@@ -1057,7 +1817,7 @@ Return this exact JSON array format:
         rule_name = "Entry-Level Cart Completion"
         if rule_name not in existing_rule_names:
             cart_threshold = max(25, int(analysis['price_range']['average'] * 0.8))
-            logger.info(f"Generating Entry-Level Cart Completion rule with cart threshold: ${cart_threshold}")
+            logger.info("Generating Entry-Level Cart Completion rule with cart threshold: $%s", cart_threshold)
             conditions = {
                 "cart_value_operator": "greater_than",
                 "cart_value": cart_threshold
@@ -1080,7 +1840,7 @@ Return this exact JSON array format:
         rule_name = "Mid-Range Upsell"
         if rule_name not in existing_rule_names:
             cart_threshold = max(50, int(analysis['price_range']['average'] * 1.2))
-            logger.info(f"Generating Mid-Range Upsell rule with cart threshold: ${cart_threshold}")
+            logger.info("Generating Mid-Range Upsell rule with cart threshold: $%s", cart_threshold)
             conditions = {
                 "cart_value_operator": "greater_than",
                 "cart_value": cart_threshold
@@ -1103,7 +1863,7 @@ Return this exact JSON array format:
         rule_name = "High-Value Customer Targeting"
         if rule_name not in existing_rule_names:
             cart_threshold = max(100, int(analysis['order_patterns']['avg_order_value'] * 0.8))
-            logger.info(f"Generating High-Value Customer rule with cart threshold: ${cart_threshold}")
+            logger.info("Generating High-Value Customer rule with cart threshold: $%s", cart_threshold)
             conditions = {
                 "cart_value_operator": "greater_than",
                 "cart_value": cart_threshold
@@ -1152,7 +1912,7 @@ Return this exact JSON array format:
             
             rule_name = f"Category Engagement ({categories[0]})"
             if rule_name not in existing_rule_names:
-                logger.info(f"Generating Category Engagement rule for {categories[0]}")
+                logger.info("Generating Category Engagement rule for %s", categories[0])
                 conditions = {
                     "category": categories[0],
                     "category_operator": "contains"
@@ -1176,7 +1936,7 @@ Return this exact JSON array format:
         if rule_name not in existing_rule_names:
             min_threshold = max(20, int(analysis['price_range']['min'] * 0.8))
             max_threshold = max(80, int(analysis['price_range']['average'] * 1.2))
-            logger.info(f"Generating Cart Value Range rule: ${min_threshold}-${max_threshold}")
+            logger.info("Generating Cart Value Range rule: $%s-$%s", min_threshold, max_threshold)
             conditions = {
                 "cart_value_operator": "between",
                 "cart_value_min": min_threshold,
@@ -1196,79 +1956,44 @@ Return this exact JSON array format:
                 "use_ai": False
             })
         
-        logger.info(f"Generated {len(rules)} diverse rules: {[r['trigger_type'] for r in rules]}")
+        logger.info("Generated %s diverse rules: %s", len(rules), [r['trigger_type'] for r in rules])
         return rules
     
-    def _calculate_abandonment_rate(self, cart_events: List[Dict], orders: List[Dict]) -> float:
+    def _calculate_abandonment_rate(self, cart_event_count: int, order_count: int) -> float:
         """Calculate cart abandonment rate based on actual data"""
-        if not cart_events:
+        if not cart_event_count:
             return 0.0
         
         # Simple calculation: orders / cart events
-        return 1 - (len(orders) / len(cart_events)) if len(cart_events) > 0 else 0.0
+        return 1 - (order_count / cart_event_count)
     
-    def _calculate_avg_cart_value(self, cart_events: List[Dict]) -> float:
-        """Calculate average cart value from cart events"""
-        if not cart_events:
-            return 0.0
-        
-        cart_values = [event.get('cart_total', 0) for event in cart_events if event.get('cart_total')]
-        return sum(cart_values) / len(cart_values) if cart_values else 0.0
+    def _calculate_avg_cart_value(self, cart_stats: Dict[str, Any]) -> float:
+        """Calculate average cart value from cart event stats"""
+        return cart_stats['total'] / cart_stats['count'] if cart_stats['count'] else 0.0
     
-    async def _generate_campaign_suggestions(self, data: Dict[str, Any], insights: Dict[str, Any], user_id: str) -> List[Dict[str, Any]]:
+    async def _generate_campaign_suggestions(self, data: Dict[str, Any], user_id: str) -> List[Dict[str, Any]]:
         """Generate data-driven campaign suggestions based on actual business data"""
         
         # Analyze data for campaign creation
         data_analysis = self._analyze_data_for_campaigns(data)
         
         # Create a simpler, focused prompt using plain messages
-        messages = [
-            ("system", "You are a JSON generator. Return ONLY valid JSON. No text, no explanations, no markdown."),
-            ("user", f"""Generate campaigns JSON for this business data: {json.dumps(data_analysis, indent=2)}\n\nReturn this exact JSON array format:\n[\n  {{\n    \"name\": \"Campaign Name\",\n    \"description\": \"Description\",\n    \"campaign_type\": \"popup\",\n    \"trigger_type\": \"exit_intent\",\n    \"trigger_delay\": 0,\n    \"trigger_scroll_percentage\": 50,\n    \"target_pages\": [\"/cart\", \"/checkout\"],\n    \"excluded_pages\": [],\n    \"settings\": {{\"position\": \"center\", \"style\": \"modern\"}},\n    \"content\": {{\"title\": \"Title\", \"message\": \"Message\", \"cta_text\": \"CTA\", \"offer\": \"Offer\"}},\n    \"expected_impact\": \"high\",\n    \"implementation_notes\": \"Notes\"\n  }}\n]\n""")
-        ]
+        messages, prompt_key = self._prepare_prompt("campaigns", data_analysis_json=to_prompt_json(data_analysis))
         
         try:
-            response = await self.model.ainvoke(messages)
-            
-            # Clean and parse the response
-            content = response.content.strip()
+            output = await self._cached_invoke(messages, prompt_key, self.fast_model, schema=CampaignSuggestionList)
+            campaigns = output["campaigns"]
             
-            # Remove any markdown formatting
-            if content.startswith('```json'):
-                content = content[7:]
-            if content.endswith('```'):
-                content = content[:-3]
-            content = content.strip()
-            
-            # Try to parse the JSON
-            try:
-                campaigns = json.loads(content)
-            except json.JSONDecodeError as json_error:
-                logger.error(f"JSON parsing error: {json_error}")
-                logger.error(f"Content that failed to parse: {content}")
-                # Try to extract JSON from the response
-                import re
-                json_match = re.search(r'\[.*\]', content, re.DOTALL)
-                if json_match:
-                    try:
-                        campaigns = json.loads(json_match.group())
-                        logger.info("Successfully extracted JSON from response")
-                    except:
-                        logger.error("Failed to extract JSON from AI response. AI campaigns are required.")
-                        raise Exception("AI campaign generation failed: Could not extract JSON from AI response.")
-                else:
-                    logger.error("No JSON array found in AI response. AI campaigns are required.")
-                    raise Exception("AI campaign generation failed: No JSON array found in AI response.")
-            
-            if isinstance(campaigns, list) and len(campaigns) > 0:
-                logger.info(f"Successfully generated {len(campaigns)} AI-driven campaigns")
+            if campaigns:
+                logger.info("Successfully generated %s AI-driven campaigns", len(campaigns))
                 return campaigns
             else:
                 logger.error("AI returned empty or invalid campaigns. AI campaigns are required.")
                 raise Exception("AI campaign generation failed: AI returned empty or invalid campaigns.")
                 
         except Exception as e:
-            logger.error(f"Error generating AI campaigns: {str(e)}")
+            await self._forget_response(prompt_key, self.fast_model, CampaignSuggestionList)
+            logger.error("Error generating AI campaigns: %s", e)
             logger.error("CRITICAL: AI campaigns are required. No fallback allowed.")
             raise Exception(f"AI campaign generation failed: {str(e)}")
     
@@ -1276,32 +2001,26 @@ Return this exact JSON array format:
         """Analyze actual data to create data-driven campaign insights"""
         
         products = data.get('shopify_products', [])
-        orders = data.get('shopify_orders', [])
-        cart_events = data.get('cart_events', [])
+        order_count = data.get('shopify_orders_count', 0)
+        cart_event_count = data.get('cart_events_count', 0)
+        order_stats = data.get('shopify_orders_stats', value_stats([], 'total_price'))
         
         # Analyze product pricing
-        prices = [p.get('price', 0) for p in products if p.get('price')]
-        price_analysis = {
-            'min': min(prices) if prices else 0,
-            'max': max(prices) if prices else 0,
-            'average': sum(prices) / len(prices) if prices else 0,
-            'count': len(prices)
-        }
+        price_analysis = self._price_stats(data)
         
         # Analyze order patterns
-        order_totals = [o.get('total_price', 0) for o in orders if o.get('total_price')]
-        avg_order_value = sum(order_totals) / len(order_totals) if order_totals else 0
+        avg_order_value = order_stats['total'] / order_stats['count'] if order_stats['count'] else 0
         
         # Calculate abandonment rate
-        abandonment_rate = self._calculate_abandonment_rate(cart_events, orders)
+        abandonment_rate = self._calculate_abandonment_rate(cart_event_count, order_count)
         
         # Sample product names for context
-        sample_products = [p.get('title', 'Unknown')[:20] for p in products[:3]]
+        sample_products = [p.get('title', 'Unknown')[:20] for p in first_by_id(products, 3)]
         
         return {
             'price_range': price_analysis,
-            'total_orders': len(orders),
-            'total_cart_events': len(cart_events),
+            'total_orders': order_count,
+            'total_cart_events': cart_event_count,
             'abandonment_rate': abandonment_rate,
             'avg_order_value': avg_order_value,
             'sample_products': sample_products
@@ -1444,73 +2163,76 @@ Return this exact JSON array format:
                 "implementation_notes": f"Welcome new customers with {analysis['total_orders']} total orders"
             })
         
-        logger.info(f"Generated {len(campaigns)} data-driven campaigns based on actual business data")
+        logger.info("Generated %s data-driven campaigns based on actual business data", len(campaigns))
         return campaigns
     
     async def _generate_priority_actions(self, insights: Dict[str, Any], rules: List[Dict], campaigns: List[Dict]) -> List[Dict[str, Any]]:
         """Generate priority actions based on insights and suggestions"""
         
-        priority_actions = []
-        
-        # Add high-impact insights as priority actions
-        for insight_type, insight_list in insights.items():
-            if isinstance(insight_list, list):
-                for insight in insight_list:
-                    if isinstance(insight, dict) and insight.get('impact') == 'high':
-                        priority_actions.append({
-                            "name": f"High Impact {insight_type.replace('_', ' ').title()}",
-                            "description": insight.get('insight', insight.get('opportunity', '')),
-                            "priority": "high",
-                            "action": insight.get('action', insight.get('implementation', '')),
-                            "type": "insight"
-                        })
-        
-        # Add high-impact rules as priority actions
-        for rule in rules:
-            if rule.get('expected_impact') == 'high':
-                priority_actions.append({
-                    "name": f"Implement Rule: {rule.get('name', '')}",
-                    "description": rule.get('description', ''),
-                    "priority": "high",
-                    "action": f"Create upsell rule: {rule.get('name', '')}",
-                    "type": "rule",
-                    "rule_data": rule
-                })
-        
-        # Add high-impact campaigns as priority actions
-        for campaign in campaigns:
-            if campaign.get('expected_impact') == 'high':
-                priority_actions.append({
-                    "name": f"Launch Campaign: {campaign.get('name', '')}",
-                    "description": campaign.get('description', ''),
-                    "priority": "high",
-                    "action": f"Create campaign: {campaign.get('name', '')}",
-                    "type": "campaign",
-                    "campaign_data": campaign
-                })
+        def iter_actions():
+            # Add high-impact insights as priority actions
+            for insight_type, insight_list in insights.items():
+                if isinstance(insight_list, list):
+                    for insight in insight_list:
+                        if isinstance(insight, dict) and insight.get('impact') == 'high':
+                            yield {
+                                "name": f"High Impact {insight_type.replace('_', ' ').title()}",
+                                "description": insight.get('insight') or insight.get('opportunity', ''),
+                                "priority": "high",
+                                "action": insight.get('action') or insight.get('implementation', ''),
+                                "type": "insight"
+                            }
+            
+            # Add high-impact rules as priority actions
+            for rule in rules:
+                if rule.get('expected_impact') == 'high':
+                    name = rule.get('name', '')
+                    yield {
+                        "name": f"Implement Rule: {name}",
+                        "description": rule.get('description', ''),
+                        "priority": "high",
+                        "action": f"Create upsell rule: {name}",
+                        "type": "rule",
+                        "rule_data": rule
+                    }
+            
+            # Add high-impact campaigns as priority actions
+            for campaign in campaigns:
+                if campaign.get('expected_impact') == 'high':
+                    name = campaign.get('name', '')
+                    yield {
+                        "name": f"Launch Campaign: {name}",
+                        "description": campaign.get('description', ''),
+                        "priority": "high",
+                        "action": f"Create campaign: {name}",
+                        "type": "campaign",
+                        "campaign_data": campaign
+                    }
         
-        return priority_actions[:5]  # Limit to top 5 priority actions
+        # Stop as soon as the top 5 priority actions are built
+        return list(islice(iter_actions(), 5))
     
     def _create_data_summary(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Create a summary of the data for analysis"""
         # Filter for active rules and campaigns
         active_campaigns = [c for c in data.get('campaigns', []) if c.get('status') == 'active']
         active_rules = [r for r in data.get('upsell_rules', []) if r.get('status') == 'active']
+        price_stats = self._price_stats(data)
         
         return {
             "customer_behavior": {
-                "total_orders": len(data.get('shopify_orders', [])),
-                "total_cart_events": len(data.get('cart_events', [])),
+                "total_orders": data.get('shopify_orders_count', 0),
+                "total_cart_events": data.get('cart_events_count', 0),
                 "analysis_period_days": data.get('analysis_period_days', 30)
             },
             "performance": {
-                "total_upsell_events": len(data.get('upsell_events', [])),
+                "total_upsell_events": data.get('upsell_events_count', 0),
                 "total_campaigns": len(active_campaigns),  # Only active campaigns
                 "total_rules": len(active_rules)           # Only active rules
             },
             "products": {
                 "total_products": len(data.get('shopify_products', [])),
-                "product_price_range": self._get_product_price_range(data.get('shopify_products', []))
+                "product_price_range": {key: price_stats[key] for key in ("min", "max", "average")}
             },
             "user_profile": {
                 "plan_type": data.get('profiles', {}).get('plan_type', 'unknown'),
@@ -1522,33 +2244,66 @@ Return this exact JSON array format:
     
     def _get_campaign_status_breakdown(self, campaigns: List[Dict]) -> Dict[str, int]:
         """Get breakdown of campaign statuses"""
-        breakdown = {}
-        for campaign in campaigns:
-            status = campaign.get('status', 'unknown')
-            breakdown[status] = breakdown.get(status, 0) + 1
-        return breakdown
+        return dict(Counter(campaign.get('status', 'unknown') for campaign in campaigns))
     
     def _get_rule_type_breakdown(self, rules: List[Dict]) -> Dict[str, int]:
         """Get breakdown of rule types"""
-        breakdown = {}
-        for rule in rules:
-            rule_type = rule.get('rule_type', 'unknown')
-            breakdown[rule_type] = breakdown.get(rule_type, 0) + 1
-        return breakdown
+        return dict(Counter(rule.get('rule_type', 'unknown') for rule in rules))
+    
+    def _create_llm_summary(self, data_summary: Dict[str, Any]) -> Dict[str, Any]:
+        """The data summary minus fields with no analytic value, so the prompt spends fewer tokens"""
+        return {key: value for key, value in data_summary.items() if key not in LLM_SUMMARY_EXCLUDED}
+    
+    def _price_stats(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Product price range and count, computed once per data dict and shared by every reader"""
+        stats = data.get('shopify_products_price_stats')
+        if stats is None:
+            stats = data['shopify_products_price_stats'] = self._get_product_price_range(data.get('shopify_products', []))
+        return stats
     
     def _get_product_price_range(self, products: List[Dict]) -> Dict[str, Any]:
         """Get product price range information"""
         if not products:
-            return {"min": 0, "max": 0, "average": 0}
+            return {"min": 0, "max": 0, "average": 0, "count": 0}
+        
+        # Large catalogs: let NumPy's vectorized reductions do the work
+        if len(products) >= NUMPY_PRICE_THRESHOLD:
+            import numpy as np
+            prices = np.fromiter((p['price'] for p in products if p.get('price')), dtype=np.float64)
+            if not prices.size:
+                return {"min": 0, "max": 0, "average": 0, "count": 0}
+            return {
+                "min": float(prices.min()),
+                "max": float(prices.max()),
+                "average": float(prices.mean()),
+                "count": int(prices.size)
+            }
         
-        prices = [p.get('price', 0) for p in products if p.get('price')]
-        if not prices:
-            return {"min": 0, "max": 0, "average": 0}
+        # Otherwise a single pass collecting min, max and total together
+        count = 0
+        total = 0
+        low = high = None
+        for p in products:
+            price = p.get('price')
+            if not price:
+                continue
+            if count == 0:
+                low = high = price
+            elif price < low:
+                low = price
+            elif price > high:
+                high = price
+            total += price
+            count += 1
+        
+        if not count:
+            return {"min": 0, "max": 0, "average": 0, "count": 0}
         
         return {
-            "min": min(prices),
-            "max": max(prices),
-            "average": sum(prices) / len(prices)
+            "min": low,
+            "max": high,
+            "average": total / count,
+            "count": count
         }
     
     def _generate_fallback_insights(self, data_summary: Dict[str, Any]) -> Dict[str, Any]:
@@ -1617,131 +2372,19 @@ Return this exact JSON array format:
     
     def _generate_fallback_rules(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Generate fallback rules when AI fails"""
-        return [
-            {
-                "name": "Cart Value Upsell",
-                "description": "Show upsell when cart value is above threshold",
-                "trigger_type": "cart_value",
-                "trigger_conditions": {
-                    "cart_value_operator": "greater_than",
-                    "cart_value": 50
-                },
-                "actions": {
-                    "action_type": "show_campaign",
-                    "campaign_id": "cart_value_upsell"
-                },
-                "priority": 5,
-                "expected_impact": "medium",
-                "implementation_notes": "Create a campaign for cart value upsells"
-            }
-        ]
+        return list(FALLBACK_RULES)
     
     def _generate_fallback_campaigns(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Generate fallback campaigns when AI fails"""
-        return [
-            {
-                "name": "Exit Intent Upsell",
-                "description": "Show upsell when user tries to leave",
-                "campaign_type": "popup",
-                "trigger_type": "exit_intent",
-                "trigger_delay": 0,
-                "trigger_scroll_percentage": 50,
-                "target_pages": ["/cart", "/checkout"],
-                "excluded_pages": [],
-                "settings": {
-                    "position": "center",
-                    "style": "modern"
-                },
-                "content": {
-                    "title": "Wait! Don't miss out on savings!",
-                    "message": "Add one more item and get 10% off your entire order!",
-                    "cta_text": "Add to Cart",
-                    "offer": "10% off entire order"
-                },
-                "expected_impact": "medium",
-                "implementation_notes": "Create exit intent popup campaign"
-            }
-        ]
+        return list(FALLBACK_CAMPAIGNS)
 
     def _generate_demo_rules_with_defaults(self) -> List[Dict[str, Any]]:
         """Generate demo rules with sensible defaults when no data is available"""
         logger.info("Generating demo rules with default values")
         
-        rules = []
-        
-        # Rule 1: Entry-Level Cart Completion
-        rules.append({
-            "name": "Entry-Level Cart Completion ($50)",
-            "description": "Encourage customers to add one more item when cart reaches $50",
-            "trigger_type": "cart_value",
-            "trigger_conditions": {
-                "cart_value_operator": "greater_than",
-                "cart_value": 50.00
-            },
-            "target_products": [],
-            "ai_copy_id": None,
-            "display_type": "popup",
-            "display_settings": {},
-            "priority": 5,
-            "status": "draft",
-            "use_ai": False
-        })
-        
-        # Rule 2: Mid-Range Upsell
-        rules.append({
-            "name": "Mid-Range Upsell ($100)",
-            "description": "Show premium products when cart value exceeds $100",
-            "trigger_type": "cart_value",
-            "trigger_conditions": {
-                "cart_value_operator": "greater_than",
-                "cart_value": 100.00
-            },
-            "target_products": [],
-            "ai_copy_id": None,
-            "display_type": "popup",
-            "display_settings": {},
-            "priority": 6,
-            "status": "draft",
-            "use_ai": False
-        })
-        
-        # Rule 3: Premium Upsell
-        rules.append({
-            "name": "Premium Upsell ($200)",
-            "description": "Target high-value customers with premium product suggestions",
-            "trigger_type": "cart_value",
-            "trigger_conditions": {
-                "cart_value_operator": "greater_than",
-                "cart_value": 200.00
-            },
-            "target_products": [],
-            "ai_copy_id": None,
-            "display_type": "popup",
-            "display_settings": {},
-            "priority": 7,
-            "status": "draft",
-            "use_ai": False
-        })
-        
-        # Rule 4: Time-Based Engagement
-        rules.append({
-            "name": "Time-Based Engagement (3+ minutes)",
-            "description": "Engage customers who spend significant time browsing",
-            "trigger_type": "time_based",
-            "trigger_conditions": {
-                "time_on_site_operator": "greater_than",
-                "time_on_site_min": 180
-            },
-            "target_products": [],
-            "ai_copy_id": None,
-            "display_type": "popup",
-            "display_settings": {},
-            "priority": 4,
-            "status": "draft",
-            "use_ai": False
-        })
+        rules = list(DEMO_RULES)
         
-        logger.info(f"Generated {len(rules)} demo rules with default values")
+        logger.info("Generated %s demo rules with default values", len(rules))
         return rules
 
     async def _generate_insights_simple(self, data: Dict[str, Any], user_id: str) -> Dict[str, Any]:
@@ -1750,40 +2393,21 @@ Return this exact JSON array format:
         # Create a minimal data summary
         data_summary = {
             "total_products": len(data.get("shopify_products", [])),
-            "total_orders": len(data.get("shopify_orders", [])),
+            "total_orders": data.get("shopify_orders_count", 0),
             "total_campaigns": len(data.get("campaigns", [])),
             "total_rules": len(data.get("upsell_rules", [])),
             "analysis_period": data.get("analysis_period_days", 30)
         }
         
         # Very simple prompt
-        messages = [
-            ("system", "You are a JSON generator. Return ONLY valid JSON."),
-            ("user", f"""Generate insights for this e-commerce data: {json.dumps(data_summary)}
-
-Return this exact JSON:
-{{
-    "customer_behavior_insights": [
-        {{"insight": "Limited data available", "impact": "medium", "action": "Add more products and orders"}}
-    ],
-    "performance_insights": [
-        {{"insight": "No performance data", "impact": "low", "action": "Track sales and conversions"}}
-    ],
-    "product_insights": [
-        {{"insight": "Basic product setup", "impact": "medium", "action": "Add product descriptions and images"}}
-    ],
-    "revenue_opportunities": [
-        {{"opportunity": "Implement upsell rules", "potential_impact": "Increase AOV by 15%", "implementation": "Create cart value rules"}}
-    ]
-}}""")
-        ]
+        messages, prompt_key = self._prepare_prompt("simple_insights", data_summary_json=to_prompt_json(data_summary))
         
         try:
-            response = await self.model.ainvoke(messages)
-            content = response.content.strip()
+            content = await self._cached_invoke(messages, prompt_key)
+            content = content.strip()
             
             # Log the raw response
-            logger.error(f"=== RAW AI INSIGHTS RESPONSE ===\n{content}\n=== END RESPONSE ===")
+            logger.error("=== RAW AI INSIGHTS RESPONSE ===\n%s\n=== END RESPONSE ===", content)
             
             # Clean and parse
             if content.startswith('```json'):
@@ -1792,11 +2416,12 @@ Return this exact JSON:
                 content = content[:-3]
             content = content.strip()
             
-            insights = json.loads(content)
-            return insights
+            # Parse and validate in one pass; missing sections come back as empty lists
+            return InsightsReport.model_validate_json(content).model_dump()
             
         except Exception as e:
-            logger.error(f"Simple insights generation failed: {e}")
+            await self._forget_response(prompt_key)
+            logger.error("Simple insights generation failed: %s", e)
             # Return default insights
             return {
                 "customer_behavior_insights": [
@@ -1813,17 +2438,145 @@ Return this exact JSON:
                 ]
             }
 
-# Initialize the agent
-agent = CoralResearchAgent()
+class MetricAggregator:
+    """Keeps per-user order, cart and upsell rollups fresh in the background
+    
+    A (user, time range) pair is tracked from its first analysis and refreshed every
+    refresh_seconds until it goes idle_seconds without being requested. Rollups older than
+    two refresh intervals are treated as missing, so a stalled loop never serves stale data.
+    At most concurrency pairs are refreshed at once.
+    """
+    
+    __slots__ = ("agent", "refresh_seconds", "idle_seconds", "_semaphore", "_metrics", "_last_requested")
+    
+    def __init__(self, agent: "CoralResearchAgent", refresh_seconds: float = 300, idle_seconds: float = 3600, concurrency: int = 4):
+        self.agent = agent
+        self.refresh_seconds = refresh_seconds
+        self.idle_seconds = idle_seconds
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._metrics: Dict[tuple, tuple[float, Dict[str, Any]]] = {}
+        self._last_requested: Dict[tuple, float] = {}
+    
+    def get(self, user_id: str, time_range_days: int) -> Optional[Dict[str, Any]]:
+        key = (user_id, time_range_days)
+        now = time.monotonic()
+        self._last_requested[key] = now
+        entry = self._metrics.get(key)
+        if entry and now - entry[0] < 2 * self.refresh_seconds:
+            return entry[1]
+        return None
+    
+    async def refresh(self, user_id: str, time_range_days: int) -> None:
+        async with self._semaphore:
+            metrics = await self.agent._fetch_event_metrics(user_id, time_range_days)
+        self._metrics[(user_id, time_range_days)] = (time.monotonic(), metrics)
+    
+    async def run(self) -> None:
+        while True:
+            now = time.monotonic()
+            for key, last_requested in list(self._last_requested.items()):
+                if now - last_requested > self.idle_seconds:
+                    self._last_requested.pop(key, None)
+                    self._metrics.pop(key, None)
+            
+            keys = list(self._last_requested)
+            results = await asyncio.gather(*(self.refresh(*key) for key in keys), return_exceptions=True)
+            for key, result in zip(keys, results):
+                if isinstance(result, Exception):
+                    logger.warning("Could not refresh metrics for %s: %s", key, result)
+            
+            await asyncio.sleep(self.refresh_seconds)
 
-@app.get("/")
-async def root():
-    return {
+@app.on_event("startup")
+async def startup():
+    global supabase
+    
+    # The async Supabase client issues its requests on this event loop instead of blocking it.
+    # PostgREST calls share one HTTP/2 connection pool, so concurrent table reads multiplex
+    # over a few warm TLS connections instead of opening new ones.
+    if supabase_url and supabase_key:
+        try:
+            http_client = httpx.AsyncClient(
+                base_url=f"{supabase_url.rstrip('/')}/rest/v1",
+                headers={"apikey": supabase_key, "Authorization": f"Bearer {supabase_key}"},
+                # retries=1 reconnects once when a pooled connection turns out to be dead
+                transport=httpx.AsyncHTTPTransport(
+                    http2=True,
+                    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+                    retries=1
+                ),
+                timeout=httpx.Timeout(30.0)
+            )
+            supabase = await acreate_client(supabase_url, supabase_key, options=AsyncClientOptions(httpx_client=http_client))
+            logger.info("Supabase client initialized successfully")
+        except Exception as e:
+            logger.error("Failed to initialize Supabase client: %s", e)
+            supabase = None
+    
+    # One agent per process; its Supabase client keeps a single pooled HTTP session across requests
+    app.state.agent = CoralResearchAgent()
+    
+    # With a direct Postgres DSN, read tables over asyncpg instead of the PostgREST API
+    db_url = os.getenv("SUPABASE_DB_URL")
+    if db_url:
+        import asyncpg
+        
+        async def init_connection(conn):
+            # Decode json/jsonb columns to Python objects, as the REST API does
+            for json_type in ("json", "jsonb"):
+                await conn.set_type_codec(json_type, encoder=lambda value: orjson.dumps(value).decode(), decoder=orjson.loads, schema="pg_catalog")
+        
+        app.state.agent.db_pool = await asyncpg.create_pool(
+            dsn=db_url,
+            min_size=5,
+            max_size=20,
+            max_inactive_connection_lifetime=300,
+            # Transaction-mode poolers (Supabase's on port 6543, pgbouncer) hand each query to
+            # any server connection, so prepared statements cannot be cached there
+            statement_cache_size=int(os.getenv("DB_STATEMENT_CACHE_SIZE", "0" if ":6543" in db_url else "100")),
+            init=init_connection
+        )
+        logger.info("Postgres connection pool initialized successfully")
+    
+    # Order, cart and upsell rollups for recently analyzed users are kept warm in the background.
+    # Only with a direct Postgres pool: over the REST API the rollups fall back to downloading
+    # every row in the window, so refreshing them would add load instead of saving it
+    if app.state.agent.db_pool:
+        app.state.agent.metrics = MetricAggregator(
+            app.state.agent,
+            refresh_seconds=float(os.getenv("METRICS_REFRESH_SECONDS", "300")),
+            concurrency=int(os.getenv("METRICS_REFRESH_CONCURRENCY", "4"))
+        )
+        app.state.metrics_task = asyncio.create_task(app.state.agent.metrics.run())
+    
+    # Probe responses are fixed once the clients above exist
+    app.state.status_bodies = build_status_bodies()
+
+@app.on_event("shutdown")
+async def shutdown():
+    if app.state.agent.metrics:
+        app.state.metrics_task.cancel()
+    if app.state.agent.db_pool:
+        await app.state.agent.db_pool.close()
+    if supabase:
+        await supabase.postgrest.aclose()
+
+def get_agent(request: Request) -> CoralResearchAgent:
+    return request.app.state.agent
+
+def build_status_bodies() -> Dict[str, Any]:
+    """Serialize the / and /health payloads once
+    
+    Nothing in them changes after startup except the Groq breaker state, so /health is
+    pre-serialized once per state.
+    """
+    root_payload = {
         "message": "Coral Research Agent - Upsell Engine (Updated)",
         "status": "running",
         "version": "2.0.0",
         "endpoints": {
             "POST /analyze": "Analyze user data and generate upsell insights",
+            "POST /analyze/stream": "Same analysis streamed as NDJSON, one line per result field",
             "GET /health": "Health check endpoint",
             "POST /debug": "Debug data transformation",
             "POST /test": "Test endpoint for data validation"
@@ -1833,42 +2586,43 @@ async def root():
             "groq_connected": model is not None
         }
     }
+    health_payload = {
+        "status": "healthy",
+        "service": "Coral Research Agent",
+        "version": "2.0.0",
+        "supabase_connected": supabase is not None,
+        "groq_connected": model is not None,
+        "environment": {
+            "groq_api_key_set": bool(os.getenv("GROQ_API_KEY")),
+            "supabase_url_set": bool(os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL")),
+            "port": os.getenv("PORT", "5555")
+        }
+    }
+    return {
+        "root": orjson.dumps(root_payload),
+        "health": {
+            state: orjson.dumps({**health_payload, "groq_circuit": state})
+            for state in ("closed", "open", "half_open")
+        }
+    }
+
+@app.get("/")
+async def root(request: Request):
+    return Response(request.app.state.status_bodies["root"], media_type="application/json")
 
 @app.get("/health")
-async def health_check():
+async def health_check(request: Request):
     """Simple health check that always returns healthy if the service is running"""
-    try:
-        # Basic service health - if we can reach this endpoint, the service is running
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        
-        return {
-            "status": "healthy", 
-            "service": "Coral Research Agent",
-            "version": "2.0.0",
-            "supabase_connected": supabase is not None,
-            "groq_connected": model is not None,
-            "environment": {
-                "groq_api_key_set": bool(groq_api_key),
-                "supabase_url_set": bool(os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL")),
-                "port": os.getenv("PORT", "5555")
-            }
-        }
-    except Exception as e:
-        logger.error(f"Health check failed: {str(e)}")
-        return {
-            "status": "healthy",  # Always return healthy to pass Railway healthcheck
-            "service": "Coral Research Agent",
-            "version": "2.0.0",
-            "error": str(e),
-            "supabase_connected": False,
-            "groq_connected": False
-        }
+    # Basic service health - if we can reach this endpoint, the service is running
+    return Response(request.app.state.status_bodies["health"][groq_breaker.state], media_type="application/json")
 
-@app.post("/analyze", response_model=AnalysisResponse)
-async def analyze_user_data(request: AnalysisRequest):
+# AnalysisResponse documents the result in OpenAPI; the result is built internally, so it is
+# serialized as-is instead of being validated again against a response_model
+@app.post("/analyze", responses={200: {"model": AnalysisResponse}})
+async def analyze_user_data(request: AnalysisRequest, agent: CoralResearchAgent = Depends(get_agent)):
     try:
-        logger.info(f"Starting analysis for user {request.user_id}")
-        logger.info(f"Request data: {request.model_dump()}")
+        logger.info("Starting analysis for user %s", request.user_id)
+        logger.debug("Request data: %r", request)
         
         # Determine time range (handle both field names)
         time_range = request.time_range_days or request.analysis_days or 30
@@ -1880,31 +2634,52 @@ async def analyze_user_data(request: AnalysisRequest):
             sent_data=request.data
         )
         
-        logger.info(f"Analysis completed for user {request.user_id}")
-        return AnalysisResponse(**result)
+        logger.info("Analysis completed for user %s", request.user_id)
+        # Results are per user, so only the client's own cache may reuse them
+        return OrjsonResponse(result, headers={"Cache-Control": (
+            f"private, max-age={int(ANALYSIS_FRESH_SECONDS)}, "
+            f"stale-while-revalidate={int(analysis_cache.ttl - ANALYSIS_FRESH_SECONDS)}"
+        )})
         
     except Exception as e:
-        logger.error(f"Analysis failed for user {request.user_id}: {str(e)}")
-        logger.error(f"Exception type: {type(e).__name__}")
-        logger.error(f"Exception details: {e}")
-        logger.error(f"Full traceback: {traceback.format_exc()}")
-        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
-
-@app.post("/debug")
-async def debug_request(request: AnalysisRequest):
+        logger.exception("Analysis failed for user %s", request.user_id)
+        if is_transient(e):
+            raise HTTPException(status_code=503, detail=ANALYSIS_UNAVAILABLE, headers=RETRY_AFTER_HEADERS)
+        raise HTTPException(status_code=500, detail=ANALYSIS_FAILED)
+
+@app.post("/analyze/stream")
+async def analyze_user_data_stream(request: AnalysisRequest, agent: CoralResearchAgent = Depends(get_agent)):
+    """Stream the analysis as NDJSON, one line per result field as soon as it is ready"""
+    time_range = request.time_range_days or request.analysis_days or 30
+    
+    async def ndjson_lines():
+        yield orjson.dumps({"event": "start", "data": {"user_id": request.user_id, "analysis_timestamp": datetime.now().isoformat()}}) + b"\n"
+        try:
+            async for field, value in agent.astream_analysis(request.user_id, time_range, request.data):
+                yield orjson.dumps({"event": field, "data": value}, default=str) + b"\n"
+            yield orjson.dumps({"event": "done"}) + b"\n"
+        except Exception as e:
+            logger.exception("Streaming analysis failed for user %s", request.user_id)
+            detail = ANALYSIS_UNAVAILABLE if is_transient(e) else ANALYSIS_FAILED
+            yield orjson.dumps({"event": "error", "detail": detail}) + b"\n"
+    
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+@app.post("/debug", response_class=OrjsonResponse)
+async def debug_request(request: AnalysisRequest, agent: CoralResearchAgent = Depends(get_agent)):
     """Debug endpoint to see what data is being sent"""
     try:
-        logger.info(f"=== DEBUG REQUEST ===")
-        logger.info(f"User ID: {request.user_id}")
-        logger.info(f"Analysis Type: {request.analysis_type}")
-        logger.info(f"Time Range Days: {request.time_range_days}")
-        logger.info(f"Analysis Days: {request.analysis_days}")
-        logger.info(f"Data is None: {request.data is None}")
+        logger.info("=== DEBUG REQUEST ===")
+        logger.info("User ID: %s", request.user_id)
+        logger.info("Analysis Type: %s", request.analysis_type)
+        logger.info("Time Range Days: %s", request.time_range_days)
+        logger.info("Analysis Days: %s", request.analysis_days)
+        logger.info("Data is None: %s", request.data is None)
         
         if request.data:
             logger.info("Processing sent data from UpsellEngine...")
             transformed_data = agent._transform_upsell_engine_data(request.data)
-            logger.info(f"Transformed data result: {json.dumps(transformed_data, indent=2, default=str)}")
+            logger.info("Transformed data result: %s", orjson.dumps(transformed_data, default=str, option=orjson.OPT_INDENT_2).decode())
             
             return {
                 "status": "success",
@@ -1923,10 +2698,10 @@ async def debug_request(request: AnalysisRequest):
                     "sample_cart_event": request.data.get('cart_events', [{}])[0] if request.data.get('cart_events') else None
                 }
             }
-        elif agent.supabase:
+        elif agent.db_pool or agent.supabase:
             logger.info("Testing Supabase connection...")
-            data = await agent._fetch_user_data(request.user_id, request.time_range_days or 30)
-            logger.info(f"Data fetch result: {json.dumps(data, indent=2, default=str)}")
+            data = await agent._fetch_user_data(request.user_id, request.time_range_days or 30, use_metrics=False)
+            logger.info("Data fetch result: %s", orjson.dumps(data, default=str, option=orjson.OPT_INDENT_2).decode())
             
             return {
                 "status": "success",
@@ -1952,31 +2727,31 @@ async def debug_request(request: AnalysisRequest):
             }
             
     except Exception as e:
-        logger.error(f"Debug request failed: {str(e)}")
+        logger.error("Debug request failed: %s", e)
         return {
             "status": "error",
             "message": str(e)
         }
 
-@app.post("/test")
-async def test_endpoint(request: AnalysisRequest):
+@app.post("/test", response_class=OrjsonResponse)
+async def test_endpoint(request: AnalysisRequest, agent: CoralResearchAgent = Depends(get_agent)):
     """Test endpoint to debug data issues"""
     try:
-        logger.info(f"=== TEST ENDPOINT ===")
-        logger.info(f"User ID: {request.user_id}")
-        logger.info(f"Analysis Type: {request.analysis_type}")
-        logger.info(f"Time Range Days: {request.time_range_days}")
-        logger.info(f"Analysis Days: {request.analysis_days}")
-        logger.info(f"Data is None: {request.data is None}")
+        logger.info("=== TEST ENDPOINT ===")
+        logger.info("User ID: %s", request.user_id)
+        logger.info("Analysis Type: %s", request.analysis_type)
+        logger.info("Time Range Days: %s", request.time_range_days)
+        logger.info("Analysis Days: %s", request.analysis_days)
+        logger.info("Data is None: %s", request.data is None)
         
         if request.data:
-            logger.info(f"Data keys: {list(request.data.keys())}")
-            logger.info(f"Products count: {len(request.data.get('products', []))}")
-            logger.info(f"Orders count: {len(request.data.get('orders', []))}")
+            logger.info("Data keys: %s", list(request.data.keys()))
+            logger.info("Products count: %s", len(request.data.get('products', [])))
+            logger.info("Orders count: %s", len(request.data.get('orders', [])))
             
             # Test transformation
             transformed = agent._transform_upsell_engine_data(request.data)
-            logger.info(f"Transformed successfully: {len(transformed.get('shopify_products', []))} products")
+            logger.info("Transformed successfully: %s products", len(transformed.get('shopify_products', [])))
             
             return {
                 "status": "success",
@@ -1998,7 +2773,7 @@ async def test_endpoint(request: AnalysisRequest):
             }
             
     except Exception as e:
-        logger.error(f"Test endpoint failed: {str(e)}")
+        logger.error("Test endpoint failed: %s", e)
         return {
             "status": "error",
             "message": str(e)
@@ -2007,4 +2782,8 @@ async def test_endpoint(request: AnalysisRequest):
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 5555))
-    uvicorn.run(app, host="0.0.0.0", port=port) 
\ No newline at end of file
+    # One worker per core (capped at 4) unless WEB_CONCURRENCY says otherwise; workers need the import string
+    workers = int(os.getenv("WEB_CONCURRENCY", min(os.cpu_count() or 1, 4)))
+    # uvloop and httptools ship with uvicorn[standard]; name them so a missing extra fails loudly.
+    # A deeper accept backlog absorbs connection bursts while workers are busy.
+    uvicorn.run("web_service:app", host="0.0.0.0", port=port, workers=workers, loop="uvloop", http="httptools", backlog=2048) 
\ No newline at end of file